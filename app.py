@@ -5,12 +5,22 @@ import os
 from dotenv import load_dotenv
 import pandas as pd
 import time
-from collections import defaultdict
+import requests
+from collections import defaultdict, OrderedDict, Counter
 from datetime import datetime
 import io
+import threading
+import queue
+import sqlite3
+import json
+import hashlib
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from datetime import datetime
 import streamlit as st
 
@@ -27,6 +37,7 @@ load_dotenv()
 
 CONFIG = {
   'url': os.getenv('ODOO_URL'),
+  'protocol': os.getenv('ODOO_PROTOCOL', 'xmlrpc').lower(),
   'db': os.getenv('ODOO_DB'),
   'username': os.getenv('ODOO_USERNAME'),
   'password': os.getenv('ODOO_PASSWORD'),
@@ -34,6 +45,25 @@ CONFIG = {
   'hq_company_name': os.getenv('HQ_COMPANY_NAME'),
   'app_username': os.getenv('APP_USERNAME'),
   'app_password': os.getenv('APP_PASSWORD'),
+  'lot_chunk_size': int(os.getenv('LOT_CHUNK_SIZE', 500)),
+  'stream_batch_size': int(os.getenv('STREAM_BATCH_SIZE', 0)), # lots per streamed check batch; 0 = LOT_CHUNK_SIZE x RPC workers
+  'check_mode': os.getenv('CHECK_MODE', 'lot').lower(), # 'lot' or 'location_first'
+  'quant_page_size': int(os.getenv('QUANT_PAGE_SIZE', 5000)),
+  'return_max_workers': int(os.getenv('RETURN_MAX_WORKERS', 4)),
+  'return_grouping': os.getenv('RETURN_GROUPING', 'product').lower(), # 'product' or 'picking'
+  'return_journal_path': os.getenv('RETURN_JOURNAL_PATH', 'return_journal.sqlite3'),
+  'default_rpc_latency': float(os.getenv('DEFAULT_RPC_LATENCY', 0.3)), # seconds, used until calls are measured
+  'job_workers': int(os.getenv('JOB_WORKERS', 2)),
+  'job_history': int(os.getenv('JOB_HISTORY', 20)),
+  'job_ttl': float(os.getenv('JOB_TTL', 3600)), # seconds a finished job is kept, for every session
+  'progress_interval': float(os.getenv('PROGRESS_INTERVAL', 0.5)), # seconds between progress updates
+  'progress_step': float(os.getenv('PROGRESS_STEP', 0.01)), # minimum fraction of the total between updates
+  'rpc_max_workers': int(os.getenv('ODOO_RPC_MAX_WORKERS', 4)),
+  'rpc_timeout': float(os.getenv('ODOO_RPC_TIMEOUT', 120)),
+  'odoo_pool_size': int(os.getenv('ODOO_POOL_SIZE', 8)),
+  'odoo_uid_ttl': float(os.getenv('ODOO_UID_TTL', 3600)),
+  'master_cache_size': int(os.getenv('MASTER_DATA_CACHE_SIZE', 50000)),
+  'master_cache_ttl': float(os.getenv('MASTER_DATA_CACHE_TTL', 3600)),
 }
 
 # Enhanced Custom CSS for professional styling
@@ -574,6 +604,160 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+class LotStatusIndex:
+  """Review status of every damaged lot: pending, approved, rejected or processed.
+
+  Each lot has exactly one status. Membership, transitions and per-status
+  counts are O(1); each status keeps its lots in insertion order.
+  """
+  STATUSES = ('pending', 'approved', 'rejected', 'processed')
+
+  def __init__(self):
+    self._status = {}
+    self._lots = {status: {} for status in self.STATUSES} # dict keys as ordered sets
+    self.version = 0 # bumped on every change, for caches of status-dependent views
+
+  def status(self, lot):
+    return self._status.get(lot)
+
+  def has(self, lot, status):
+    return self._status.get(lot) == status
+
+  def lots(self, status):
+    return list(self._lots[status])
+
+  def count(self, status):
+    return len(self._lots[status])
+
+  def counts(self):
+    """Snapshot of {status: number of lots}, kept up to date by every transition"""
+    return {status: len(lots) for status, lots in self._lots.items()}
+
+  def set(self, lots, status):
+    """Move lots to `status` from whatever status they had"""
+    members = self._lots[status]
+    for lot in lots:
+      previous = self._status.get(lot)
+      if previous == status:
+        continue
+      if previous is not None:
+        del self._lots[previous][lot]
+      members[lot] = None
+      self._status[lot] = status
+      self.version += 1
+
+  def discard(self, lots):
+    for lot in lots:
+      previous = self._status.pop(lot, None)
+      if previous is not None:
+        del self._lots[previous][lot]
+        self.version += 1
+
+  def sync_pending(self, damaged_lots):
+    """Make the current damaged lots without a decision the pending set"""
+    self.discard(self.lots('pending'))
+    self.set((lot for lot in damaged_lots if lot not in self._status), 'pending')
+
+class LotResultStore:
+  """Columnar table of checked lots, shared by the result views and the Excel report.
+
+  One row per lot with typed columns: repeated strings (location, vendor,
+  SKU, ...) are categoricals and prices/quantities are floats, instead of a
+  nested details dict per lot. Stores are immutable; extend/merge/subset
+  return new stores, so a reader never sees a half-built table.
+  """
+  CATEGORY_COLUMNS = ('location', 'status', 'reference', 'product_name', 'sku', 'vendor')
+  FLOAT_COLUMNS = ('price_unit', 'discount', 'cost_price', 'available_qty')
+  DTYPES = {
+    'lot': 'object',
+    'damaged': 'bool',
+    **{column: 'category' for column in CATEGORY_COLUMNS},
+    **{column: 'float64' for column in FLOAT_COLUMNS},
+  }
+
+  def __init__(self, frame=None):
+    if frame is None:
+      frame = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in self.DTYPES.items()})
+    self.frame = frame
+    self.token = uuid.uuid4().hex # identifies this (immutable) table in view caches
+    self._by_lot = None # frame indexed by lot, built on the first lookup
+    self.damaged_count = int(frame['damaged'].sum())
+    self.non_damaged_count = len(frame) - self.damaged_count
+
+  @staticmethod
+  def _rows(items, damaged):
+    for item in items:
+      details = item.get('details') or {}
+      po_details = details.get('po_details') or {}
+      yield {
+        'lot': item['lot'],
+        'damaged': damaged,
+        'location': item['location'],
+        'status': item['status'],
+        'reference': details.get('reference', 'N/A'),
+        'product_name': details.get('product_name', 'N/A'),
+        'sku': details.get('sku', 'N/A'),
+        'vendor': po_details.get('vendor', 'N/A'),
+        'price_unit': po_details.get('price_unit', 0),
+        'discount': po_details.get('discount', 0),
+        'cost_price': po_details.get('cost_price', 0),
+        'available_qty': details.get('available_qty', 0),
+      }
+
+  @classmethod
+  def from_results(cls, non_damaged, damaged):
+    """Build a store from the (non_damaged, damaged) item lists of check_inventory_stream"""
+    rows = [*cls._rows(non_damaged, False), *cls._rows(damaged, True)]
+    if not rows:
+      return cls()
+    return cls(pd.DataFrame(rows, columns=list(cls.DTYPES)).astype(cls.DTYPES))
+
+  def _concat(self, other):
+    if other.frame.empty:
+      return self
+    if self.frame.empty:
+      return other
+    # Categories differ between chunks, so re-categorize after the concat
+    frame = pd.concat([self.frame, other.frame], ignore_index=True)
+    return LotResultStore(frame.astype({column: 'category' for column in self.CATEGORY_COLUMNS}))
+
+  def extend(self, non_damaged, damaged):
+    return self._concat(LotResultStore.from_results(non_damaged, damaged))
+
+  def merge(self, other):
+    """Rows of both stores; for lots in both, the row from `other` wins"""
+    if self.frame.empty or other.frame.empty:
+      return self._concat(other)
+    kept = LotResultStore(self.frame[~self.frame['lot'].isin(other.frame['lot'])].reset_index(drop=True))
+    return kept._concat(other)
+
+  def subset(self, lots):
+    return LotResultStore(self.frame[self.frame['lot'].isin(lots)].reset_index(drop=True))
+
+  def rows(self, damaged):
+    return self.frame[self.frame['damaged'] == damaged]
+
+  def lots(self, damaged):
+    return self.rows(damaged)['lot'].tolist()
+
+  def lookup(self, lots):
+    """Rows for `lots` in that order, indexed by lot; unknown lots get 'N/A' and zeros"""
+    if self._by_lot is None:
+      self._by_lot = self.frame.drop_duplicates('lot', keep='last').set_index('lot')
+    records = self._by_lot.reindex(lots)
+    records = records.astype({column: 'object' for column in self.CATEGORY_COLUMNS})
+    return records.fillna({
+      **{column: 'N/A' for column in self.CATEGORY_COLUMNS},
+      **{column: 0 for column in self.FLOAT_COLUMNS},
+    })
+
+LOT_STATUS_LABELS = {
+  'pending': 'Pending Action',
+  'approved': 'Approved for Return',
+  'rejected': 'Rejected for Return',
+  'processed': 'Return Processed',
+}
+
 # Initialize session state variables
 if 'authenticated' not in st.session_state:
   st.session_state.authenticated = False
@@ -589,10 +773,8 @@ if 'models' not in st.session_state:
   st.session_state.models = None
 if 'damaged_lots' not in st.session_state:
   st.session_state.damaged_lots = []
-if 'approved_lots' not in st.session_state:
-  st.session_state.approved_lots = []
-if 'rejected_lots' not in st.session_state:
-  st.session_state.rejected_lots = []
+if 'lot_status' not in st.session_state:
+  st.session_state.lot_status = LotStatusIndex()
 if 'processed_lots' not in st.session_state:
   st.session_state.processed_lots = {} # This should be a dictionary, not a list
 if 'excel_data' not in st.session_state:
@@ -601,151 +783,634 @@ if 'selected_damaged_lots' not in st.session_state:
   st.session_state.selected_damaged_lots = []
 if 'select_all_damaged' not in st.session_state:
   st.session_state.select_all_damaged = False
-if 'lot_details' not in st.session_state:
-  st.session_state.lot_details = {}
+if 'results_job_id' not in st.session_state:
+  st.session_state.results_job_id = None # check job whose results are shown
+if 'table_cache' not in st.session_state:
+  st.session_state.table_cache = {} # view name -> (key, built table)
+if 'lot_history' not in st.session_state:
+  st.session_state.lot_history = LotResultStore() # rows of reviewed lots from earlier analyses
 if 'lot_po_mapping' not in st.session_state:
   st.session_state.lot_po_mapping = {}
-if "process_clicked" not in st.session_state:
-    st.session_state.process_clicked = False
+if 'company_id' not in st.session_state:
+  st.session_state.company_id = None
+if 'damage_location_id' not in st.session_state:
+  st.session_state.damage_location_id = None
+if 'lot_name_ids' not in st.session_state:
+  st.session_state.lot_name_ids = {} # stock.lot name -> ids, kept for the session
+if 'unknown_lot_names' not in st.session_state:
+  st.session_state.unknown_lot_names = set() # names with no stock.lot in the current analysis
+if 'lot_resolution' not in st.session_state:
+  st.session_state.lot_resolution = {} # lot -> move line, picking and PO origin for the current analysis
+if 'return_plan' not in st.session_state:
+  st.session_state.return_plan = None
+
+class TimeoutTransportMixin:
+  """Apply a socket timeout to every connection an XML-RPC transport opens"""
+  timeout = None
+
+  def make_connection(self, host):
+    connection = super().make_connection(host)
+    connection.timeout = self.timeout
+    return connection
+
+class TimeoutTransport(TimeoutTransportMixin, xmlrpc.client.Transport):
+  pass
+
+class SafeTimeoutTransport(TimeoutTransportMixin, xmlrpc.client.SafeTransport):
+  pass
+
+class JsonRpcProxy:
+  """Drop-in replacement for an xmlrpc ServerProxy that speaks Odoo's /jsonrpc endpoint.
+
+  Errors are raised as xmlrpc.client.Fault so callers handle both transports
+  the same way. Requests go through one keep-alive HTTP session per proxy.
+  """
+
+  def __init__(self, service):
+    self.service = service
+    self.url = f"{CONFIG['url']}/jsonrpc"
+    self._session = requests.Session()
+    self._request_id = 0
+
+  def _call(self, method, *args):
+    self._request_id += 1
+    response = self._session.post(self.url, json={
+      'jsonrpc': '2.0',
+      'method': 'call',
+      'params': {'service': self.service, 'method': method, 'args': list(args)},
+      'id': self._request_id,
+    }, timeout=CONFIG['rpc_timeout'])
+    response.raise_for_status()
+    body = response.json()
+    if body.get('error'):
+      error = body['error']
+      message = (error.get('data') or {}).get('message') or error.get('message', 'Unknown JSON-RPC error')
+      raise xmlrpc.client.Fault(error.get('code', 0), message)
+    return body.get('result')
+
+  def authenticate(self, *args):
+    return self._call('authenticate', *args)
+
+  def execute_kw(self, *args):
+    return self._call('execute_kw', *args)
+
+def make_server_proxy(endpoint):
+  """Create a proxy for an Odoo service (ODOO_PROTOCOL=xmlrpc|jsonrpc) with the configured per-call timeout"""
+  if CONFIG['protocol'] == 'jsonrpc':
+    return JsonRpcProxy(endpoint)
+
+  url = f"{CONFIG['url']}/xmlrpc/2/{endpoint}"
+  transport = SafeTimeoutTransport() if url.startswith('https') else TimeoutTransport()
+  transport.timeout = CONFIG['rpc_timeout']
+  return xmlrpc.client.ServerProxy(url, transport=transport)
+
+class OdooConnectionPool:
+  """Process-wide pool of keep-alive Odoo `object` proxies shared by all sessions.
+
+  Both transports reuse their HTTP connection between calls, so a proxy
+  checked back into the pool keeps its socket open for the next caller.
+  The pool also caches the authenticated uid until it expires, so sessions
+  logging in at the same time do not each call `authenticate`.
+  The pool exposes `execute_kw` itself and can stand in for a proxy.
+  """
+
+  def __init__(self, size, uid_ttl):
+    self.size = max(1, size)
+    self.uid_ttl = uid_ttl
+    self._idle = queue.LifoQueue()
+    self._created = 0
+    self._lock = threading.Lock()
+    self._uid = None
+    self._uid_expires = 0
+    self._latency = {} # (model, method) -> moving average seconds per call
+
+  def get_uid(self, force=False):
+    """Return the cached uid, authenticating again when it is missing or expired"""
+    with self._lock:
+      if force or not self._uid or time.monotonic() >= self._uid_expires:
+        uid = make_server_proxy('common').authenticate(CONFIG['db'], CONFIG['username'], CONFIG['password'], {})
+        if not uid:
+          raise ValueError("Authentication rejected by Odoo")
+        self._uid = uid
+        self._uid_expires = time.monotonic() + self.uid_ttl
+      return self._uid
+
+  def _acquire(self):
+    try:
+      return self._idle.get_nowait()
+    except queue.Empty:
+      pass
+    with self._lock:
+      if self._created < self.size:
+        self._created += 1
+        return make_server_proxy('object')
+    return self._idle.get(timeout=CONFIG['rpc_timeout'])
+
+  @contextmanager
+  def checkout(self):
+    """Borrow a proxy for the duration of a `with` block"""
+    proxy = self._acquire()
+    try:
+      yield proxy
+    finally:
+      self._idle.put(proxy)
+
+  def execute_kw(self, *args):
+    start = time.perf_counter()
+    with self.checkout() as proxy:
+      result = proxy.execute_kw(*args)
+    self._record_latency(args[3], args[4], time.perf_counter() - start)
+    return result
+
+  def _record_latency(self, model, method, seconds):
+    with self._lock:
+      average = self._latency.get((model, method))
+      self._latency[(model, method)] = seconds if average is None else average * 0.8 + seconds * 0.2
+
+  def latency(self, model, method, default=None):
+    """Measured seconds per call for model.method, falling back to the method's average across models"""
+    with self._lock:
+      if (model, method) in self._latency:
+        return self._latency[(model, method)]
+      same_method = [v for (_, m), v in self._latency.items() if m == method]
+    return sum(same_method) / len(same_method) if same_method else default
+
+@st.cache_resource
+def get_connection_pool(size, uid_ttl):
+  """Shared Odoo connection pool for every Streamlit session in this process"""
+  return OdooConnectionPool(size, uid_ttl)
+
+def gather(futures, timeout):
+  """Results of `futures` in order, under one deadline for the whole batch.
+
+  On a timeout or the first failure, calls that have not started yet are
+  cancelled so they do not hold the shared workers, and the error is raised.
+  """
+  done, not_done = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+  if not_done:
+    for future in not_done:
+      future.cancel()
+    for future in done:
+      if future.exception() is not None:
+        raise future.exception()
+    raise TimeoutError(f"{len(not_done)} of {len(futures)} Odoo calls did not finish within {timeout:g}s")
+  return [future.result() for future in futures]
+
+class RpcExecutor:
+  """Bounded thread pool for independent Odoo calls.
+
+  Workers run calls through a thread-safe `models` object (the shared
+  connection pool). Results are returned in the order the calls were given.
+  """
+
+  def __init__(self, max_workers, timeout):
+    self.max_workers = max(1, max_workers)
+    self.timeout = timeout
+    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='odoo-rpc')
+
+  def map(self, models, uid, calls):
+    """Run (model, method, args, kwargs) calls concurrently, results in input order"""
+    futures = [
+      self._pool.submit(models.execute_kw, CONFIG['db'], uid, CONFIG['password'], model, method, args, kwargs or {})
+      for model, method, args, kwargs in calls
+    ]
+    return gather(futures, self.timeout)
+
+@st.cache_resource
+def get_rpc_executor(max_workers, timeout):
+  """Process-wide RPC executor, shared by all sessions to cap load on Odoo"""
+  return RpcExecutor(max_workers, timeout)
+
+def execute_parallel(calls):
+  """Execute independent (model, method, args, kwargs) calls, concurrently when more than one"""
+  if len(calls) <= 1 or CONFIG['rpc_max_workers'] <= 1:
+    return [
+      st.session_state.models.execute_kw(
+        CONFIG['db'], st.session_state.uid, CONFIG['password'],
+        model, method, args, kwargs or {}
+      )
+      for model, method, args, kwargs in calls
+    ]
+
+  executor = get_rpc_executor(CONFIG['rpc_max_workers'], CONFIG['rpc_timeout'])
+  return executor.map(st.session_state.models, st.session_state.uid, calls)
 
 def connect_to_odoo():
   """Connect to Odoo and store connection in session state"""
   try:
-    common = xmlrpc.client.ServerProxy(f"{CONFIG['url']}/xmlrpc/2/common")
-    uid = common.authenticate(CONFIG['db'], CONFIG['username'], CONFIG['password'], {})
-    models = xmlrpc.client.ServerProxy(f"{CONFIG['url']}/xmlrpc/2/object")
+    models = get_connection_pool(CONFIG['odoo_pool_size'], CONFIG['odoo_uid_ttl'])
+    uid = models.get_uid()
    
     st.session_state.uid = uid
     st.session_state.models = models
+    resolve_reference_locations()
     st.session_state.odoo_connected = True
    
     return True, "Connection successful!"
   except Exception as e:
     return False, f"Connection failed: {str(e)}"
 
-def get_product_details(lot_name):
-  """Get detailed product information for a specific lot/serial number"""
-  try:
-    # Find the move line for this lot
-    move_lines = st.session_state.models.execute_kw(
-      CONFIG['db'], st.session_state.uid, CONFIG['password'],
-      'stock.move.line', 'search_read',
-      [[('lot_id.name', '=', lot_name)]],
-      {'fields': ['picking_id', 'product_id'], 'limit': 1}
-    )
-   
-    if not move_lines:
-      return None
-     
-    product_id = move_lines[0]['product_id'][0] if move_lines[0].get('product_id') else None
-    picking_id = move_lines[0]['picking_id'][0] if move_lines[0].get('picking_id') else None
-   
-    if not product_id or not picking_id:
-      return None
-   
-    # Get product details
-    product = st.session_state.models.execute_kw(
+def resolve_reference_locations():
+  """Resolve the HQ company and its Damage/Stock location once and keep the ids with the connection"""
+  companies = st.session_state.models.execute_kw(
+    CONFIG['db'], st.session_state.uid, CONFIG['password'],
+    'res.company', 'search_read',
+    [[['name', '=', CONFIG['hq_company_name']]]],
+    {'fields': ['id'], 'limit': 1}
+  )
+  company_id = companies[0]['id'] if companies else None
+
+  damage_location = []
+  if company_id:
+    # Find Damage/Stock Location (same as product_return.py)
+    damage_location = st.session_state.models.execute_kw(
       CONFIG['db'], st.session_state.uid, CONFIG['password'],
-      'product.product', 'read',
-      [product_id], {'fields': ['name', 'default_code', 'product_tmpl_id']}
+      'stock.location', 'search_read',
+      [[['complete_name', 'ilike', 'Damge/Stock'], ['company_id', '=', company_id]]],
+      {'fields': ['id'], 'limit': 1}
     )
-   
-    if not product:
-      return None
-     
-    # Get picking details (reference/name)
-    picking = st.session_state.models.execute_kw(
+
+  st.session_state.company_id = company_id
+  st.session_state.damage_location_id = damage_location[0]['id'] if damage_location else None
+  return st.session_state.damage_location_id
+
+def is_damage_location(location):
+  """Match a quant's location_id against the resolved Damage/Stock id (display name if unresolved)"""
+  if not location:
+    return False
+  if st.session_state.damage_location_id:
+    return location[0] == st.session_state.damage_location_id
+  return location[1] == CONFIG['damage_location_name']
+
+class MasterDataCache:
+  """Process-wide TTL + LRU cache for slow-changing Odoo records, keyed by (model, key).
+
+  Only master data (products, templates, vendors, PO lines) goes through
+  here; stock levels such as stock.quant are always read live.
+  """
+
+  def __init__(self, maxsize, ttl):
+    self.maxsize = max(1, maxsize)
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get_many(self, model, keys):
+    """Return ({key: record} for fresh entries, [keys that must be fetched])"""
+    found, missing = {}, []
+    now = time.monotonic()
+    with self._lock:
+      for key in keys:
+        entry = self._entries.get((model, key))
+        if entry and entry[0] > now:
+          self._entries.move_to_end((model, key))
+          found[key] = entry[1]
+          self.hits += 1
+        else:
+          if entry:
+            del self._entries[(model, key)]
+          missing.append(key)
+          self.misses += 1
+    return found, missing
+
+  def put_many(self, model, records):
+    """Store {key: record} entries, evicting the least recently used beyond maxsize"""
+    expires = time.monotonic() + self.ttl
+    with self._lock:
+      for key, record in records.items():
+        self._entries[(model, key)] = (expires, record)
+        self._entries.move_to_end((model, key))
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+
+  def invalidate(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def stats(self):
+    with self._lock:
+      return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+@st.cache_resource
+def get_master_data_cache(maxsize, ttl):
+  """Master data cache shared by every session in this process"""
+  return MasterDataCache(maxsize, ttl)
+
+def master_data_cache():
+  return get_master_data_cache(CONFIG['master_cache_size'], CONFIG['master_cache_ttl'])
+
+@st.cache_resource
+def get_lookup_executor(max_workers):
+  """Process-wide pool for independent lookups; each may fan out further through the RPC executor"""
+  return ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='odoo-lookup')
+
+def run_parallel(*lookups):
+  """Run independent lookup callables concurrently with this script's context, results in argument order"""
+  if len(lookups) <= 1 or CONFIG['rpc_max_workers'] <= 1:
+    return [lookup() for lookup in lookups]
+
+  ctx = get_script_run_ctx()
+
+  def run(lookup):
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return lookup()
+
+  executor = get_lookup_executor(CONFIG['rpc_max_workers'])
+  futures = [executor.submit(run, lookup) for lookup in lookups]
+  return gather(futures, CONFIG['rpc_timeout'])
+
+def chunk_list(items, size):
+  """Split a list into consecutive chunks of at most `size` items"""
+  size = max(1, size)
+  return [items[i:i + size] for i in range(0, len(items), size)]
+
+def read_by_ids(model, ids, fields):
+  """Read many records of one model with a single read per chunk, keyed by id"""
+  records = {}
+  unique_ids = [i for i in dict.fromkeys(ids) if i]
+
+  calls = [
+    (model, 'read', [chunk], {'fields': fields})
+    for chunk in chunk_list(unique_ids, CONFIG['lot_chunk_size'])
+  ]
+  for chunk_records in execute_parallel(calls):
+    for record in chunk_records:
+      records[record['id']] = record
+
+  return records
+
+def search_read_in(model, field, values, fields, domain=None):
+  """Run a search_read filtered by `field in values`, one call per chunk of values"""
+  records = []
+  unique_values = [v for v in dict.fromkeys(values) if v]
+
+  calls = [
+    (model, 'search_read', [[(field, 'in', chunk)] + list(domain or [])], {'fields': fields})
+    for chunk in chunk_list(unique_values, CONFIG['lot_chunk_size'])
+  ]
+  for chunk_records in execute_parallel(calls):
+    records.extend(chunk_records)
+
+  return records
+
+def read_master_data(model, ids, fields):
+  """read_by_ids through the master data cache; only uncached ids are read from Odoo"""
+  cache = master_data_cache()
+  unique_ids = [i for i in dict.fromkeys(ids) if i]
+  records, missing = cache.get_many(model, unique_ids)
+
+  # Entries cached with fewer fields are treated as misses
+  stale = [i for i, record in records.items() if not all(f in record for f in fields)]
+  for i in stale:
+    del records[i]
+
+  fetched = read_by_ids(model, missing + stale, fields)
+  cache.put_many(model, fetched)
+  records.update(fetched)
+  return records
+
+def read_po_lines(pairs):
+  """First purchase.order.line per (PO name, product id) pair, served from the master data cache"""
+  cache = master_data_cache()
+  lines, missing = cache.get_many('purchase.order.line', list(dict.fromkeys(pairs)))
+  if not missing:
+    return lines
+
+  fetched = {}
+  for line in search_read_in(
+    'purchase.order.line', 'order_id.name', [po for po, _ in missing],
+    ['order_id', 'product_id', 'price_unit', 'discount'],
+    domain=[('product_id', 'in', list(dict.fromkeys(pid for _, pid in missing)))]
+  ):
+    if line.get('order_id') and line.get('product_id'):
+      fetched.setdefault((line['order_id'][1], line['product_id'][0]), line)
+
+  fetched = {pair: fetched[pair] for pair in missing if pair in fetched}
+  cache.put_many('purchase.order.line', fetched)
+  lines.update(fetched)
+  return lines
+
+def resolve_lot_ids(lot_names):
+  """Map lot names to stock.lot ids with one batched search_read per chunk.
+
+  Known names are kept in st.session_state.lot_name_ids for the session.
+  Names with no stock.lot are remembered for the current analysis so later
+  stages skip them without another RPC. Returns (ids, {id: name}).
+  """
+  name_ids = st.session_state.lot_name_ids
+  unknown = st.session_state.unknown_lot_names
+  names = [name for name in dict.fromkeys(lot_names) if name]
+  missing = [name for name in names if name not in name_ids and name not in unknown]
+
+  if missing:
+    for lot in search_read_in('stock.lot', 'name', missing, ['name']):
+      name_ids.setdefault(lot['name'], []).append(lot['id'])
+    unknown.update(name for name in missing if name not in name_ids)
+
+  id_to_name = {lot_id: name for name in names for lot_id in name_ids.get(name, [])}
+  return list(id_to_name), id_to_name
+
+def resolve_lots(lot_names):
+  """Resolve each lot's first move line, picking and PO origin once per analysis.
+
+  Results are kept in st.session_state.lot_resolution so enrichment, the PO
+  mapping and return processing all read the same records; only lots not yet
+  in the index are fetched.
+  """
+  index = st.session_state.lot_resolution
+  missing = [lot for lot in dict.fromkeys(lot_names) if lot and lot not in index]
+  if not missing:
+    return index
+
+  # First move line per lot (same default ordering as a limit=1 search)
+  lot_ids, id_to_name = resolve_lot_ids(missing)
+  move_line_by_lot = {}
+  for ml in search_read_in('stock.move.line', 'lot_id', lot_ids, ['id', 'lot_id', 'picking_id', 'product_id']):
+    if ml.get('lot_id') and ml['lot_id'][0] in id_to_name:
+      move_line_by_lot.setdefault(id_to_name[ml['lot_id'][0]], ml)
+
+  picking_ids = [ml['picking_id'][0] for ml in move_line_by_lot.values() if ml.get('picking_id')]
+  pickings = read_by_ids('stock.picking', picking_ids, ['name', 'origin'])
+
+  for lot in missing:
+    move_line = move_line_by_lot.get(lot)
+    picking = pickings.get(move_line['picking_id'][0]) if move_line and move_line.get('picking_id') else None
+    index[lot] = {
+      'move_line': move_line,
+      'picking': picking,
+      'origin': picking.get('origin') if picking else None,
+    }
+
+  return index
+
+def fetch_quants_by_lot(lot_names):
+  """Fetch stock.quant records for many lots with one search_read per chunk, grouped by lot name"""
+  quants_by_lot = defaultdict(list)
+  lot_ids, id_to_name = resolve_lot_ids(lot_names)
+
+  for q in search_read_in('stock.quant', 'lot_id', lot_ids, ['lot_id', 'location_id', 'quantity']):
+    if q.get('lot_id') and q['lot_id'][0] in id_to_name:
+      quants_by_lot[id_to_name[q['lot_id'][0]]].append(q)
+
+  return quants_by_lot
+
+def fetch_damage_quants():
+  """Read every positive-quantity quant in Damage/Stock with paged queries, grouped by lot name"""
+  damage_quants = defaultdict(list)
+  last_id = 0
+
+  while True:
+    page = st.session_state.models.execute_kw(
       CONFIG['db'], st.session_state.uid, CONFIG['password'],
-      'stock.picking', 'read',
-      [picking_id], {'fields': ['name', 'origin']}
+      'stock.quant', 'search_read',
+      [[('location_id', '=', st.session_state.damage_location_id), ('quantity', '>', 0), ('id', '>', last_id)]],
+      {'fields': ['lot_id', 'location_id', 'quantity'], 'order': 'id', 'limit': CONFIG['quant_page_size']}
     )
-   
-    if not picking:
-      return None
-     
-    po_number = picking[0].get('origin', 'Not Found')
-    reference = picking[0].get('name', 'Not Found')
-   
-    # Get purchase order details
+    for q in page:
+      if q.get('lot_id'):
+        damage_quants[q['lot_id'][1]].append(q)
+    if len(page) < CONFIG['quant_page_size']:
+      break
+    last_id = page[-1]['id']
+
+  return damage_quants
+
+def fetch_quants_location_first(lot_names, damage_quants=None):
+  """Classify against the whole Damage/Stock quant set, then fetch quants only for the other lots.
+
+  Lots found in Damage/Stock keep just their damage quants, so their
+  locations/available_qty reflect that location only. Pass `damage_quants`
+  to reuse a set already read for an earlier chunk.
+  """
+  if damage_quants is None:
+    damage_quants = fetch_damage_quants()
+  unique_lots = list(dict.fromkeys(lot_names))
+
+  quants_by_lot = fetch_quants_by_lot([lot for lot in unique_lots if lot not in damage_quants])
+  for lot in unique_lots:
+    if lot in damage_quants:
+      quants_by_lot[lot] = damage_quants[lot]
+
+  return quants_by_lot
+
+def get_product_details_bulk(lot_names, quants_by_lot=None):
+  """Get detailed product information for many lots, reading each model once per batch.
+
+  Pass `quants_by_lot` (from fetch_quants_by_lot) to reuse stock levels that
+  were already fetched instead of querying stock.quant again.
+  """
+  lot_names = list(dict.fromkeys(lot_names))
+  if not lot_names:
+    return {}
+
+  # Move lines and pickings come from the per-analysis resolution index
+  index = resolve_lots(lot_names)
+  move_line_by_lot = {lot: index[lot]['move_line'] for lot in lot_names if index[lot]['move_line']}
+  pickings = {
+    entry['picking']['id']: entry['picking']
+    for entry in (index[lot] for lot in lot_names) if entry['picking']
+  }
+
+  # Products, purchase orders and stock levels only depend on the resolution index: read them together
+  product_ids = [ml['product_id'][0] for ml in move_line_by_lot.values() if ml.get('product_id')]
+  po_numbers = [p['origin'] for p in pickings.values() if p.get('origin') and p['origin'] != 'Not Found']
+  lookups = [
+    lambda: read_master_data('product.product', product_ids, ['name', 'default_code', 'product_tmpl_id']),
+    lambda: search_read_in('purchase.order', 'name', po_numbers, ['name', 'partner_id']),
+  ]
+  if quants_by_lot is None:
+    lookups.append(lambda: fetch_quants_by_lot(lot_names))
+  products, purchase_orders, *fetched_quants = run_parallel(*lookups)
+  if fetched_quants:
+    quants_by_lot = fetched_quants[0]
+
+  po_by_name = {}
+  for po in purchase_orders:
+    po_by_name.setdefault(po['name'], po)
+
+  # Vendors, order lines and templates depend on the reads above, not on each other
+  vendor_ids = [po['partner_id'][0] for po in po_by_name.values() if po.get('partner_id')]
+
+  # Only the (PO, product) pairs actually used by these lots
+  po_line_pairs = []
+  for ml in move_line_by_lot.values():
+    picking = pickings.get(ml['picking_id'][0]) if ml.get('picking_id') else None
+    if picking and ml.get('product_id') and picking.get('origin') in po_by_name:
+      po_line_pairs.append((picking['origin'], ml['product_id'][0]))
+
+  template_ids = [p['product_tmpl_id'][0] for p in products.values() if p.get('product_tmpl_id')]
+
+  vendors, po_line_by_key, templates = run_parallel(
+    lambda: read_master_data('res.partner', vendor_ids, ['name']),
+    lambda: read_po_lines(po_line_pairs),
+    lambda: read_master_data('product.template', template_ids, ['name']),
+  )
+
+  # Join everything locally into the per-lot details shape
+  details_by_lot = {}
+  for lot_name in lot_names:
+    move_line = move_line_by_lot.get(lot_name)
+    if not move_line:
+      continue
+
+    product_id = move_line['product_id'][0] if move_line.get('product_id') else None
+    picking_id = move_line['picking_id'][0] if move_line.get('picking_id') else None
+
+    if not product_id or not picking_id:
+      continue
+
+    product = products.get(product_id)
+    picking = pickings.get(picking_id)
+    if not product or not picking:
+      continue
+
+    po_number = picking.get('origin', 'Not Found')
+    reference = picking.get('name', 'Not Found')
+
     po_details = None
-    if po_number and po_number != 'Not Found':
-      po_records = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'purchase.order', 'search_read',
-        [[('name', '=', po_number)]],
-        {'fields': ['partner_id'], 'limit': 1}
-      )
-     
-      if po_records:
-        vendor_id = po_records[0].get('partner_id')[0] if po_records[0].get('partner_id') else None
-       
-        # Get vendor name
-        if vendor_id:
-          vendor = st.session_state.models.execute_kw(
-            CONFIG['db'], st.session_state.uid, CONFIG['password'],
-            'res.partner', 'read',
-            [vendor_id], {'fields': ['name']}
-          )
-          vendor_name = vendor[0].get('name', 'Not Found') if vendor else 'Not Found'
-        else:
-          vendor_name = 'Not Found'
-       
-        # Get purchase order line details (price, discount)
-        po_lines = st.session_state.models.execute_kw(
-          CONFIG['db'], st.session_state.uid, CONFIG['password'],
-          'purchase.order.line', 'search_read',
-          [[('order_id.name', '=', po_number), ('product_id', '=', product_id)]],
-          {'fields': ['price_unit', 'discount']}
-        )
-       
-        if po_lines:
-          price_unit = po_lines[0].get('price_unit', 0)
-          discount = po_lines[0].get('discount', 0)
-          cost_price = price_unit * (1 - discount/100)
-        else:
-          price_unit = 0
-          discount = 0
-          cost_price = 0
-       
-        po_details = {
-          'po_number': po_number,
-          'vendor': vendor_name,
-          'price_unit': price_unit,
-          'discount': discount,
-          'cost_price': cost_price
-        }
-   
-    # Get product template for SKU
+    po_record = po_by_name.get(po_number) if po_number and po_number != 'Not Found' else None
+    if po_record:
+      vendor_id = po_record['partner_id'][0] if po_record.get('partner_id') else None
+      vendor = vendors.get(vendor_id) if vendor_id else None
+      vendor_name = vendor.get('name', 'Not Found') if vendor else 'Not Found'
+
+      po_line = po_line_by_key.get((po_number, product_id))
+      if po_line:
+        price_unit = po_line.get('price_unit', 0)
+        discount = po_line.get('discount', 0)
+        cost_price = price_unit * (1 - discount/100)
+      else:
+        price_unit = 0
+        discount = 0
+        cost_price = 0
+
+      po_details = {
+        'po_number': po_number,
+        'vendor': vendor_name,
+        'price_unit': price_unit,
+        'discount': discount,
+        'cost_price': cost_price
+      }
+
     product_template = None
-    if product[0].get('product_tmpl_id'):
-      template_id = product[0]['product_tmpl_id'][0]
-      template = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'product.template', 'read',
-        [template_id], {'fields': ['name']}
-      )
+    if product.get('product_tmpl_id'):
+      template = templates.get(product['product_tmpl_id'][0])
       if template:
-        product_template = template[0].get('name', 'Not Found')
-   
-    # Get location information
-    quant_records = st.session_state.models.execute_kw(
-      CONFIG['db'], st.session_state.uid, CONFIG['password'],
-      'stock.quant', 'search_read',
-      [[('lot_id.name', '=', lot_name)]],
-      {'fields': ['location_id', 'quantity']}
-    )
+        product_template = template.get('name', 'Not Found')
 
     locations = []
     available_qty = 0
+    for q in quants_by_lot.get(lot_name, []):
+      if q.get('location_id'):
+        locations.append(q['location_id'][1])
+      available_qty += q.get('quantity', 0)
 
-    if quant_records:
-      for q in quant_records:
-        if q.get('location_id'):
-          locations.append(q['location_id'][1])
-        available_qty += q.get('quantity', 0)
-   
-    product_name = product[0].get('name', 'Not Found')
-    sku = product[0].get('default_code')
+    product_name = product.get('name', 'Not Found')
+    sku = product.get('default_code')
 
     if not sku or sku.lower() == "false" or sku.strip() == "":
       match = re.search(r'\s(\S+)$', product_name)
@@ -754,7 +1419,7 @@ def get_product_details(lot_name):
       else:
         sku = "Not Found"
 
-    return {
+    details_by_lot[lot_name] = {
       'lot_name': lot_name,
       'product_name': product_name,
       'sku': sku,
@@ -766,317 +1431,619 @@ def get_product_details(lot_name):
       'available_qty': available_qty
 
     }
-   
-  except Exception as e:
-    st.error(f"Error getting product details for {lot_name}: {str(e)}")
-    return None
 
-def check_inventory(lot_serials):
-  """Check if lot/serial numbers are in damage stock with detailed information"""
-  not_in_damage_stock = []
-  in_damage_stock = []
- 
-  # Show progress for large datasets
-  progress_bar = st.progress(0)
-  status_text = st.empty()
- 
-  total_lots = len([ls.strip() for ls in lot_serials if ls.strip()])
+  return details_by_lot
+
+class ProgressReporter:
+  """Throttled progress sink for background jobs.
+
+  It only updates the job's counters and status text, which the UI polls.
+  Updates are emitted at most every PROGRESS_INTERVAL seconds and
+  PROGRESS_STEP of the total (the final one always goes out), with
+  throughput and ETA appended to the status text.
+  """
+
+  def __init__(self, job, unit='lots'):
+    self.job = job
+    self.unit = unit
+    self._started = time.monotonic()
+    self._last_time = None
+    self._last_fraction = 0.0
+
+  def status(self, text):
+    self.job.message = text
+
+  def update(self, done, total, text=None):
+    now = time.monotonic()
+    fraction = done / total if total else 1.0
+    if done < total and self._last_time is not None and (
+      now - self._last_time < CONFIG['progress_interval'] or fraction - self._last_fraction < CONFIG['progress_step']
+    ):
+      return
+    self._last_time, self._last_fraction = now, fraction
+
+    self.job.done, self.job.total = done, total
+
+    elapsed = now - self._started
+    rate = done / elapsed if elapsed > 0 else 0
+    if rate and done < total:
+      eta_seconds = int((total - done) / rate)
+      eta = f"{eta_seconds // 60}m {eta_seconds % 60:02d}s" if eta_seconds >= 60 else f"{eta_seconds}s"
+      self.status(f"{text or f'{done:,} of {total:,} {self.unit}'} • {rate:,.1f} {self.unit}/sec • ETA {eta}")
+    elif text:
+      self.status(text)
+
+  def error(self, message):
+    self.job.errors.append(message)
+
+def check_inventory_stream(lot_serials, progress):
+  """Check lots chunk by chunk, yielding (non_damaged, damaged) for each chunk as soon as it is classified"""
+  lots = [ls.strip() for ls in lot_serials if ls.strip()]
+  total_lots = len(lots)
   processed = 0
- 
-  for lot in [ls.strip() for ls in lot_serials if ls.strip()]:
-    processed += 1
-    progress_bar.progress(processed / total_lots)
-    status_text.text(f"Processing {processed} of {total_lots} lots...")
-   
-    # Get detailed product information
-    product_details = get_product_details(lot)
 
-# 🔥 Always store full details for later usage (Approved, Rejected, Processed)
-    if product_details:
-        st.session_state.lot_details[lot] = product_details
-   
-    quant_records = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.quant', 'search_read',
-        [[('lot_id.name', '=', lot)]],
-        {'fields': ['lot_id', 'location_id', 'quantity']}
-    )
+  # Each analysis starts with a fresh lot resolution index
+  st.session_state.lot_resolution = {}
+  st.session_state.unknown_lot_names = set()
+
+  damage_quants = None
+  if CONFIG['check_mode'] == 'location_first' and st.session_state.damage_location_id:
+    progress.status("Reading Damage/Stock quants...")
+    damage_quants = fetch_damage_quants()
+
+  # Batches span several RPC chunks so each batch's reads run on the RPC executor in parallel
+  batch_size = CONFIG['stream_batch_size'] or CONFIG['lot_chunk_size'] * CONFIG['rpc_max_workers']
+  for chunk in chunk_list(lots, batch_size):
+    not_in_damage_stock = []
+    in_damage_stock = []
+
+    # One stock.quant query per chunk, shared by enrichment and damage classification
+    progress.status(f"Fetching stock levels for lots {processed + 1}-{processed + len(chunk)} of {total_lots}...")
+    if damage_quants is not None:
+      quants_by_lot = fetch_quants_location_first(chunk, damage_quants)
+    else:
+      quants_by_lot = fetch_quants_by_lot(chunk)
 
-    if quant_records:
-        # New condition → location must be 'Damge/Stock' AND qty > 0
-        found_in_damage = any(
-            q['location_id'][1] == CONFIG['damage_location_name'] and q.get('quantity', 0) > 0
-            for q in quant_records
-        )
+    # Resolve product/PO/vendor details for the whole chunk in one batch
+    progress.status(f"Fetching product details for lots {processed + 1}-{processed + len(chunk)} of {total_lots}...")
+    try:
+      details_by_lot = get_product_details_bulk(chunk, quants_by_lot=quants_by_lot)
+    except Exception as e:
+      progress.error(f"Error getting product details: {str(e)}")
+      details_by_lot = {}
 
-        # Get all locations
-        locations = {q['location_id'][1] for q in quant_records if q['location_id']}
+    for lot in chunk:
+      processed += 1
+      progress.update(processed, total_lots, f"Processing {processed} of {total_lots} lots...")
+     
+      product_details = details_by_lot.get(lot)
+     
+      quant_records = quants_by_lot.get(lot, [])
 
-        if found_in_damage:
-            in_damage_stock.append({
-                'lot': lot,
-                'location': CONFIG['damage_location_name'],
-                'status': 'In Damage',
-                'details': product_details
-            })
-        else:
-            not_in_damage_stock.append({
-                'lot': lot,
-                'location': ", ".join(locations) if locations else "Unknown",
-                'status': 'Not in Damage',
-                'details': product_details
-            })
+      if quant_records:
+          # New condition → location must be 'Damge/Stock' AND qty > 0
+          found_in_damage = any(
+              is_damage_location(q['location_id']) and q.get('quantity', 0) > 0
+              for q in quant_records
+          )
 
-    else:
-        not_in_damage_stock.append({
-            'lot': lot,
-            'location': "Not Found in stock.quant",
-            'status': 'Not Found',
-            'details': product_details
-        })
+          # Get all locations
+          locations = {q['location_id'][1] for q in quant_records if q['location_id']}
 
- 
-  progress_bar.empty()
-  status_text.empty()
- 
-  return not_in_damage_stock, in_damage_stock
+          if found_in_damage:
+              in_damage_stock.append({
+                  'lot': lot,
+                  'location': CONFIG['damage_location_name'],
+                  'status': 'In Damage',
+                  'details': product_details
+              })
+          else:
+              not_in_damage_stock.append({
+                  'lot': lot,
+                  'location': ", ".join(locations) if locations else "Unknown",
+                  'status': 'Not in Damage',
+                  'details': product_details
+              })
+
+      else:
+          not_in_damage_stock.append({
+              'lot': lot,
+              'location': "Not Found in stock.quant",
+              'status': 'Not Found',
+              'details': product_details
+          })
+
+    yield not_in_damage_stock, in_damage_stock
 
 def get_po_for_lot(lot_name):
   """Get the PO number for a specific lot/serial number"""
   try:
-    # Find the move line for this lot
-    move_lines = st.session_state.models.execute_kw(
-      CONFIG['db'], st.session_state.uid, CONFIG['password'],
-      'stock.move.line', 'search_read',
-      [[('lot_id.name', '=', lot_name)]],
-      {'fields': ['picking_id'], 'limit': 1}
-    )
-   
-    if move_lines and move_lines[0].get('picking_id'):
-      picking_id = move_lines[0]['picking_id'][0]
-     
-      # Get the picking details
-      picking = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.picking', 'read',
-        [picking_id], {'fields': ['origin']}
-      )
-     
-      if picking and picking[0].get('origin'):
-        return picking[0]['origin']
-   
-    return "Not Found"
+    origin = resolve_lots([lot_name])[lot_name]['origin']
+    return origin if origin else "Not Found"
   except Exception as e:
     return f"Error: {str(e)}"
 
-def process_product_return(lot_serials):
+class ReturnJournal:
+  """Durable SQLite journal of return groups and the last stage each one reached.
+
+  Stages, in order: wizard_created, picking_created, move_lines_written,
+  validated. A resumed run reads the journal to skip completed stages so an
+  interrupted batch never creates duplicate return pickings.
   """
-  Process product returns grouped by (PO, product).
-  ✅ Uses Damage/Stock as source location (like product_return.py).
+
+  STAGES = ('wizard_created', 'picking_created', 'move_lines_written', 'validated')
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    with self._connect() as conn:
+      conn.execute("""
+        CREATE TABLE IF NOT EXISTS return_groups (
+          group_key TEXT PRIMARY KEY,
+          lots TEXT NOT NULL,
+          stage TEXT NOT NULL,
+          wizard_id INTEGER,
+          picking_id INTEGER,
+          returned_reference TEXT,
+          updated_at TEXT NOT NULL
+        )
+      """)
+
+  def _connect(self):
+    return sqlite3.connect(self.path, timeout=30)
+
+  @staticmethod
+  def group_key(po_number, source_picking_id, lots):
+    """Stable key for a group: the same PO, source picking and lot set resume the same entry"""
+    digest = hashlib.sha1(json.dumps(sorted(lots)).encode()).hexdigest()
+    return f"{po_number}|{source_picking_id}|{digest}"
+
+  def get(self, group_key):
+    with self._lock, self._connect() as conn:
+      conn.row_factory = sqlite3.Row
+      row = conn.execute('SELECT * FROM return_groups WHERE group_key = ?', (group_key,)).fetchone()
+    return dict(row) if row else None
+
+  def record(self, group_key, lots, stage, wizard_id=None, picking_id=None, returned_reference=None):
+    """Checkpoint a group at `stage`, keeping ids recorded by earlier stages"""
+    with self._lock, self._connect() as conn:
+      conn.execute("""
+        INSERT INTO return_groups (group_key, lots, stage, wizard_id, picking_id, returned_reference, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(group_key) DO UPDATE SET
+          stage = excluded.stage,
+          wizard_id = COALESCE(excluded.wizard_id, wizard_id),
+          picking_id = COALESCE(excluded.picking_id, picking_id),
+          returned_reference = COALESCE(excluded.returned_reference, returned_reference),
+          updated_at = excluded.updated_at
+      """, (group_key, json.dumps(sorted(lots)), stage, wizard_id, picking_id, returned_reference,
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+  def close(self, group_keys):
+    """Forget finished groups, so a later return of the same lots starts fresh"""
+    with self._lock, self._connect() as conn:
+      conn.executemany('DELETE FROM return_groups WHERE group_key = ?', [(key,) for key in group_keys])
+
+def prepare_return_group(models, uid, picking_id, lots, lot_move_data, damage_location_id, group_results,
+                         journal, group_key, entry=None):
+  """Create and fill (but do not validate) one return picking for a group of lots from `picking_id`.
+
+  The group may hold one product (RETURN_GROUPING=product) or every
+  affected product of the source picking (RETURN_GROUPING=picking); each
+  wizard line is set to the number of lots of its product.
+  Each completed stage is checkpointed in `journal`; pass the group's
+  journal `entry` to resume after the last recorded stage.
+  Takes the connection explicitly and never touches st.session_state, so
+  groups can run on worker threads. Returns the new picking id, or None
+  after recording the failure for each lot in `group_results`.
   """
-  unique_lots = list(set(lot_serials))
-  if not unique_lots:
-    return False, "No Lot/Serial numbers entered."
+  product_qty = Counter(lot_move_data[lot]['product_id'][0] for lot in lots)
+  stage = entry['stage'] if entry else None
 
-  results = {}
+  try:
+    if stage == 'move_lines_written':
+      return entry['picking_id']
+    if stage == 'picking_created':
+      return fill_return_picking(models, uid, entry['picking_id'], lots, lot_move_data, product_qty,
+                                 damage_location_id, journal, group_key)
+
+    # Create return wizard (reused when the journal already has one that Odoo has not vacuumed yet)
+    wizard_id = entry['wizard_id'] if stage == 'wizard_created' else None
+    if wizard_id and not models.execute_kw(
+      CONFIG['db'], uid, CONFIG['password'],
+      'stock.return.picking', 'search', [[['id', '=', wizard_id]]]
+    ):
+      wizard_id = None # transient wizards are deleted after a while; start a fresh one
+    if not wizard_id:
+      wizard_id = models.execute_kw(
+        CONFIG['db'], uid, CONFIG['password'],
+        'stock.return.picking', 'create', [{'picking_id': picking_id}]
+      )
+      journal.record(group_key, lots, 'wizard_created', wizard_id=wizard_id)
+
+    # Update wizard lines
+    return_lines = models.execute_kw(
+      CONFIG['db'], uid, CONFIG['password'],
+      'stock.return.picking.line', 'search_read',
+      [[['wizard_id', '=', wizard_id]]],
+      {'fields': ['id', 'product_id']}
+    )
+    keep_line_ids_by_qty = defaultdict(list)
+    for line in return_lines:
+      if line['product_id'][0] in product_qty:
+        keep_line_ids_by_qty[product_qty[line['product_id'][0]]].append(line['id'])
+    drop_line_ids = [line['id'] for line in return_lines if line['product_id'][0] not in product_qty]
+    for qty, keep_line_ids in keep_line_ids_by_qty.items():
+      models.execute_kw(
+        CONFIG['db'], uid, CONFIG['password'],
+        'stock.return.picking.line', 'write',
+        [keep_line_ids, {'quantity': qty}]
+      )
+    if drop_line_ids:
+      models.execute_kw(
+        CONFIG['db'], uid, CONFIG['password'],
+        'stock.return.picking.line', 'unlink', [drop_line_ids]
+      )
+
+    # Confirm return → create return picking
+    new_picking_info = models.execute_kw(
+      CONFIG['db'], uid, CONFIG['password'],
+      'stock.return.picking', 'create_returns', [wizard_id]
+    )
+    new_picking_id = None
+    if isinstance(new_picking_info, dict) and 'res_id' in new_picking_info:
+      new_picking_id = new_picking_info['res_id']
+    elif isinstance(new_picking_info, list) and new_picking_info:
+      new_picking_id = new_picking_info[0]
+    if not new_picking_id:
+      for lot in lots:
+        group_results[lot] = {'success': False, 'message': "No return picking created"}
+      return None
+    journal.record(group_key, lots, 'picking_created', picking_id=new_picking_id)
+
+    return fill_return_picking(models, uid, new_picking_id, lots, lot_move_data, product_qty,
+                               damage_location_id, journal, group_key)
+
+  except Exception as e:
+    for lot in lots:
+      group_results[lot] = {'success': False, 'message': f"Error: {str(e)}"}
+    return None
+
+def fill_return_picking(models, uid, new_picking_id, lots, lot_move_data, product_qty, damage_location_id, journal, group_key):
+  """Point a new return picking at Damage/Stock and write its moves and per-lot move lines"""
+  # ✅ Force picking source to Damage/Stock
+  models.execute_kw(
+    CONFIG['db'], uid, CONFIG['password'],
+    'stock.picking', 'write',
+    [[new_picking_id], {'location_id': damage_location_id}]
+  )
+
+  # Update moves
+  moves = models.execute_kw(
+    CONFIG['db'], uid, CONFIG['password'],
+    'stock.move', 'search_read',
+    [[['picking_id', '=', new_picking_id]]],
+    {'fields': ['id', 'product_id']}
+  )
+  product_move_map = {m['product_id'][0]: m['id'] for m in moves if m.get('product_id')}
+
+  # One write per distinct quantity instead of one per move
+  move_ids_by_qty = defaultdict(list)
+  for m in moves:
+    move_ids_by_qty[product_qty.get(m['product_id'][0], 0)].append(m['id'])
+  for qty, move_ids in move_ids_by_qty.items():
+    models.execute_kw(
+      CONFIG['db'], uid, CONFIG['password'],
+      'stock.move', 'write',
+      [move_ids, {'location_id': damage_location_id, 'product_uom_qty': qty}]
+    )
+
+  # Clear existing move lines
+  existing_ml = models.execute_kw(
+    CONFIG['db'], uid, CONFIG['password'],
+    'stock.move.line', 'search',
+    [[['picking_id', '=', new_picking_id]]]
+  )
+  if existing_ml:
+    models.execute_kw(
+      CONFIG['db'], uid, CONFIG['password'],
+      'stock.move.line', 'unlink', [existing_ml]
+    )
+
+  # Recreate move lines per lot with a single multi-record create
+  move_line_vals = []
+  for lot in lots:
+    move_line = lot_move_data[lot]
+    pid = move_line['product_id'][0]
+    move_id = product_move_map.get(pid)
+    if not move_id:
+      continue
+    move_line_vals.append({
+      'picking_id': new_picking_id,
+      'move_id': move_id,
+      'product_id': pid,
+      'location_id': damage_location_id,
+      'lot_id': move_line['lot_id'][0],
+      'qty_done': 1,
+    })
+  if move_line_vals:
+    models.execute_kw(
+      CONFIG['db'], uid, CONFIG['password'],
+      'stock.move.line', 'create', [move_line_vals]
+    )
+
+  journal.record(group_key, lots, 'move_lines_written', picking_id=new_picking_id)
+  return new_picking_id
+
+def validate_return_pickings(models, uid, picking_ids, progress=None):
+  """Validate prepared return pickings with one button_validate call and settle wizards for the whole set.
 
-  # Group lots by (PO, product)
+  Odoo validates none of the set when one picking needs a wizard step it
+  cannot settle in bulk, or when the call fails, so every picking that is not
+  done afterwards is validated again on its own. A failed bulk call is
+  reported to `progress` and noted on every picking it left unvalidated.
+  Returns {picking_id: outcome}.
+  """
+  outcomes = {}
+  if not picking_ids:
+    return outcomes
+
+  def validate(ids):
+    validate_res = models.execute_kw(
+      CONFIG['db'], uid, CONFIG['password'],
+      'stock.picking', 'button_validate', [ids]
+    )
+    # ✅ Immediate transfer / backorder wizards are processed for every picking in the call
+    if isinstance(validate_res, dict) and validate_res.get('res_model') in ('stock.immediate.transfer', 'stock.backorder.confirmation'):
+      wiz_ids = models.execute_kw(
+        CONFIG['db'], uid, CONFIG['password'],
+        validate_res['res_model'], 'search',
+        [[['pick_ids', 'in', ids]]]
+      )
+      if wiz_ids:
+        models.execute_kw(
+          CONFIG['db'], uid, CONFIG['password'],
+          validate_res['res_model'], 'process', [wiz_ids]
+        )
+
+  def read_pickings(ids):
+    pickings = models.execute_kw(
+      CONFIG['db'], uid, CONFIG['password'],
+      'stock.picking', 'read', [ids], {'fields': ['name', 'state']}
+    )
+    return {p['id']: p for p in pickings}
+
+  bulk_error = None
+  try:
+    validate(picking_ids)
+  except Exception as e:
+    bulk_error = str(e) # settled per picking below
+    if progress:
+      progress.error(f"Bulk validation of {len(picking_ids)} return pickings failed, retrying one by one: {bulk_error}")
+  picking_by_id = read_pickings(picking_ids)
+
+  retry_ids = [pid for pid in picking_ids if picking_by_id.get(pid, {}).get('state') != 'done']
+  if retry_ids:
+    for picking_id in retry_ids:
+      try:
+        validate([picking_id])
+      except Exception as e:
+        outcomes[picking_id] = {'success': False, 'message': f"Validation failed: {str(e)}"}
+    reread_ids = [pid for pid in retry_ids if pid not in outcomes]
+    if reread_ids:
+      picking_by_id.update(read_pickings(reread_ids))
+
+  for picking_id in picking_ids:
+    if picking_id in outcomes:
+      continue
+    picking = picking_by_id.get(picking_id, {})
+    returned_reference = picking.get('name', 'N/A')
+    if picking.get('state') == 'done':
+      outcomes[picking_id] = {
+        'success': True,
+        'returned_reference': returned_reference,
+        'message': f"Return processed → Picking {returned_reference} (Source=Damage/Stock)"
+      }
+    else:
+      outcomes[picking_id] = {
+        'success': False,
+        'returned_reference': returned_reference,
+        'message': f"Return picking {returned_reference} not validated (state: {picking.get('state', 'unknown')})"
+      }
+
+  if bulk_error:
+    for picking_id in retry_ids:
+      outcomes[picking_id]['bulk_error'] = bulk_error
+      if not outcomes[picking_id]['success']:
+        outcomes[picking_id]['message'] += f" (bulk validation error: {bulk_error})"
+
+  return outcomes
+
+@st.cache_resource
+def get_return_executor(max_workers):
+  """Process-wide worker pool for return groups, capping concurrent returns against Odoo"""
+  return ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='odoo-return')
+
+def group_return_lots(lots):
+  """Group returnable lots by (PO, product), or by (PO, source picking) when consolidating.
+
+  Returns (failures, lot_groups, lot_move_data); lots that cannot be returned
+  get their failure result in `failures`.
+  """
+  results = {}
   lot_groups = defaultdict(list)
   lot_move_data = {}
 
-  for lot in unique_lots:
+  # Read the index resolve_lots returns: a check started meanwhile may replace the session's index
+  try:
+    index = resolve_lots(lots)
+  except Exception as e:
+    return {lot: {'success': False, 'message': f"Cannot process return: Error: {str(e)}"} for lot in lots}, lot_groups, lot_move_data
+
+  for lot in lots:
     try:
-      po_number = get_po_for_lot(lot)
-      if po_number.startswith("Error:") or po_number == "Not Found":
+      po_number = index[lot]['origin'] or "Not Found"
+      if po_number == "Not Found":
         results[lot] = {'success': False, 'message': f"Cannot process return: {po_number}"}
         continue
 
-      move_lines = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.move.line', 'search_read',
-        [[['lot_id.name', '=', lot]]],
-        {'fields': ['id', 'product_id', 'lot_id', 'picking_id']}
-      )
-      if not move_lines:
+      move_line = index[lot]['move_line']
+      if not move_line:
         results[lot] = {'success': False, 'message': f"No move line found for lot: {lot}"}
         continue
 
-      move_line = move_lines[0]
-      product_id = move_line['product_id'][0]
-      lot_groups[(po_number, product_id)].append(lot)
+      if CONFIG['return_grouping'] == 'picking':
+        lot_groups[(po_number, move_line['picking_id'][0])].append(lot)
+      else:
+        lot_groups[(po_number, move_line['product_id'][0])].append(lot)
       lot_move_data[lot] = move_line
 
     except Exception as e:
       results[lot] = {'success': False, 'message': f"Error preparing lot: {str(e)}"}
 
-  # Fetch company ID for filtering locations
-  company_id = st.session_state.models.execute_kw(
-    CONFIG['db'], st.session_state.uid, CONFIG['password'],
-    'res.company', 'search_read',
-    [[['name', '=', CONFIG['hq_company_name']]]],
-    {'fields': ['id'], 'limit': 1}
-  )[0]['id']
+  return results, lot_groups, lot_move_data
 
-  # Find Damage/Stock Location (same as product_return.py)
-  damage_location = st.session_state.models.execute_kw(
-    CONFIG['db'], st.session_state.uid, CONFIG['password'],
-    'stock.location', 'search_read',
-    [[['complete_name', 'ilike', 'Damge/Stock'], ['company_id', '=', company_id]]],
-    {'fields': ['id'], 'limit': 1}
-  )
-  if not damage_location:
-    return False, f"Damage location 'Damge/Stock' not found in Odoo!"
-  damage_location_id = damage_location[0]['id']
-
-  # Process each (PO, product) group
-  for (po_number, product_id), lots in lot_groups.items():
-    try:
-      picking_id = lot_move_data[lots[0]]['picking_id'][0]
-
-      # Create return wizard
-      wizard_id = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.return.picking', 'create', [{'picking_id': picking_id}]
-      )
-
-      # Update wizard lines
-      return_lines = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.return.picking.line', 'search_read',
-        [[['wizard_id', '=', wizard_id]]],
-        {'fields': ['id', 'product_id']}
-      )
-      for line in return_lines:
-        if line['product_id'][0] == product_id:
-          st.session_state.models.execute_kw(
-            CONFIG['db'], st.session_state.uid, CONFIG['password'],
-            'stock.return.picking.line', 'write',
-            [[line['id']], {'quantity': len(lots)}]
-          )
-        else:
-          st.session_state.models.execute_kw(
-            CONFIG['db'], st.session_state.uid, CONFIG['password'],
-            'stock.return.picking.line', 'unlink', [[line['id']]]
-          )
-
-      # Confirm return → create return picking
-      new_picking_info = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.return.picking', 'create_returns', [wizard_id]
-      )
-      new_picking_id = None
-      if isinstance(new_picking_info, dict) and 'res_id' in new_picking_info:
-        new_picking_id = new_picking_info['res_id']
-      elif isinstance(new_picking_info, list) and new_picking_info:
-        new_picking_id = new_picking_info[0]
-      if not new_picking_id:
-        for lot in lots:
-          results[lot] = {'success': False, 'message': "No return picking created"}
-        continue
-
-      # ✅ Force picking source to Damage/Stock
-      st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.picking', 'write',
-        [[new_picking_id], {'location_id': damage_location_id}]
-      )
+def reconcile_journal_entries(models, uid, entries):
+  """Check journaled return pickings against Odoo before a resumed run trusts them.
 
-      # Update moves
-      moves = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.move', 'search_read',
-        [[['picking_id', '=', new_picking_id]]],
-        {'fields': ['id', 'product_id']}
+  Takes {group_key: entry} and returns the entries to resume from: a picking
+  that was cancelled or deleted by hand drops its entry so the group starts
+  over, a picking found done becomes `validated`, and a `validated` entry
+  whose picking is no longer done is validated again.
+  """
+  picking_ids = [
+    entry['picking_id'] for entry in entries.values()
+    if entry and entry['stage'] != 'wizard_created' and entry['picking_id']
+  ]
+  pickings = {}
+  if picking_ids:
+    pickings = {
+      p['id']: p for p in models.execute_kw(
+        CONFIG['db'], uid, CONFIG['password'],
+        'stock.picking', 'search_read', [[['id', 'in', picking_ids]]], {'fields': ['name', 'state']}
       )
-      product_move_map = {m['product_id'][0]: m['id'] for m in moves if m.get('product_id')}
-      for m in moves:
-        pid = m['product_id'][0]
-        qty = len(lot_groups.get((po_number, pid), []))
-        st.session_state.models.execute_kw(
-          CONFIG['db'], st.session_state.uid, CONFIG['password'],
-          'stock.move', 'write',
-          [[m['id']], {'location_id': damage_location_id, 'product_uom_qty': qty}]
-        )
+    }
 
-      # Clear existing move lines
-      existing_ml = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.move.line', 'search',
-        [[['picking_id', '=', new_picking_id]]]
-      )
-      if existing_ml:
-        st.session_state.models.execute_kw(
-          CONFIG['db'], st.session_state.uid, CONFIG['password'],
-          'stock.move.line', 'unlink', [existing_ml]
-        )
+  reconciled = {}
+  for group_key, entry in entries.items():
+    if not entry or entry['stage'] == 'wizard_created':
+      reconciled[group_key] = entry
+      continue
+    picking = pickings.get(entry['picking_id'])
+    if not picking or picking['state'] == 'cancel':
+      reconciled[group_key] = None
+    elif picking['state'] == 'done':
+      reconciled[group_key] = {**entry, 'stage': 'validated', 'returned_reference': picking['name']}
+    elif entry['stage'] == 'validated':
+      reconciled[group_key] = {**entry, 'stage': 'move_lines_written'}
+    else:
+      reconciled[group_key] = entry
+  return reconciled
 
-      # Recreate move lines per lot
-      for lot in lots:
-        move_line = lot_move_data[lot]
-        pid = move_line['product_id'][0]
-        move_id = product_move_map.get(pid)
-        if not move_id:
-          continue
-        st.session_state.models.execute_kw(
-          CONFIG['db'], st.session_state.uid, CONFIG['password'],
-          'stock.move.line', 'create',
-          [{
-            'picking_id': new_picking_id,
-            'move_id': move_id,
-            'product_id': pid,
-            'location_id': damage_location_id,
-            'lot_id': move_line['lot_id'][0],
-            'qty_done': 1,
-          }]
-        )
+def process_product_return(lot_serials, resume=False, progress=None):
+  """
+  Process product returns grouped by (PO, product), or by source picking
+  with RETURN_GROUPING=picking (one return picking per receipt).
+  Progress is checkpointed in the return journal; with resume=True groups
+  continue from their last recorded stage instead of starting over.
+  An optional ProgressReporter receives per-group progress.
+  ✅ Uses Damage/Stock as source location (like product_return.py).
+  """
+  unique_lots = list(set(lot_serials))
+  if not unique_lots:
+    return False, "No Lot/Serial numbers entered."
 
-      # ✅ Validate picking (with backorder/immediate wizard handling)
-      validate_res = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.picking', 'button_validate', [[new_picking_id]]
-      )
-      if isinstance(validate_res, dict) and validate_res.get('res_model') == 'stock.immediate.transfer':
-        wiz_ids = st.session_state.models.execute_kw(
-          CONFIG['db'], st.session_state.uid, CONFIG['password'],
-          'stock.immediate.transfer', 'search',
-          [[['pick_ids', 'in', [new_picking_id]]]]
-        )
-        if wiz_ids:
-          st.session_state.models.execute_kw(
-            CONFIG['db'], st.session_state.uid, CONFIG['password'],
-            'stock.immediate.transfer', 'process', [wiz_ids]
-          )
-      elif isinstance(validate_res, dict) and validate_res.get('res_model') == 'stock.backorder.confirmation':
-        wiz_ids = st.session_state.models.execute_kw(
-          CONFIG['db'], st.session_state.uid, CONFIG['password'],
-          'stock.backorder.confirmation', 'search',
-          [[['pick_ids', 'in', [new_picking_id]]]]
-        )
-        if wiz_ids:
-          st.session_state.models.execute_kw(
-            CONFIG['db'], st.session_state.uid, CONFIG['password'],
-            'stock.backorder.confirmation', 'process', [wiz_ids]
-          )
+  try:
+    results, lot_groups, lot_move_data = group_return_lots(unique_lots)
+  except Exception as e:
+    return False, f"Error resolving lots: {str(e)}"
 
-      # Success
-      picking_data = st.session_state.models.execute_kw(
-        CONFIG['db'], st.session_state.uid, CONFIG['password'],
-        'stock.picking', 'read', [new_picking_id], {'fields': ['name']}
-      )
-      returned_reference = picking_data[0].get('name', 'N/A') if picking_data else 'N/A'
+  # Damage/Stock location resolved at connect time (refresh if it was not found then)
+  damage_location_id = st.session_state.damage_location_id or resolve_reference_locations()
+  if not damage_location_id:
+    return False, f"Damage location 'Damge/Stock' not found in Odoo!"
 
+  # Journal every group so an interrupted run can resume without duplicate pickings
+  journal = ReturnJournal(CONFIG['return_journal_path'])
+  groups = []
+  for (po_number, _), lots in lot_groups.items():
+    source_picking_id = lot_move_data[lots[0]]['picking_id'][0]
+    group_key = ReturnJournal.group_key(po_number, source_picking_id, lots)
+    groups.append((po_number, source_picking_id, lots, group_key, journal.get(group_key) if resume else None))
+
+  # Journaled pickings may have been cancelled, deleted or validated by hand since they were recorded
+  models, uid = st.session_state.models, st.session_state.uid
+  if resume:
+    try:
+      entries = reconcile_journal_entries(models, uid, {group[3]: group[4] for group in groups})
+    except Exception as e:
+      return False, f"Error checking the return journal against Odoo: {str(e)}"
+    for po_number, source_picking_id, lots, group_key, entry in groups:
+      reconciled = entries[group_key]
+      if reconciled and reconciled['stage'] == 'validated' and entry['stage'] != 'validated':
+        journal.record(group_key, lots, 'validated', returned_reference=reconciled['returned_reference'])
+    groups = [group[:4] + (entries[group[3]],) for group in groups]
+
+  # Groups whose journaled picking is confirmed done are reported without changing Odoo
+  validated_groups = []
+  for po_number, _, lots, group_key, entry in groups:
+    if entry and entry['stage'] == 'validated':
+      validated_groups.append(group_key)
       for lot in lots:
         results[lot] = {
           'success': True,
           'po_number': po_number,
-          'new_picking_id': new_picking_id,
-          'returned_reference': returned_reference,
-          'message': f"Return processed → Picking {returned_reference} (Source=Damage/Stock)"
+          'new_picking_id': entry['picking_id'],
+          'returned_reference': entry['returned_reference'],
+          'message': f"Return already processed → Picking {entry['returned_reference']} (resumed from journal)"
         }
+  groups = [group for group in groups if not (group[4] and group[4]['stage'] == 'validated')]
 
-    except Exception as e:
-      for lot in lots:
-        results[lot] = {'success': False, 'message': f"Error: {str(e)}"}
+  # Prepare each group's return picking, concurrently up to RETURN_MAX_WORKERS
+  group_calls = [
+    (models, uid, source_picking_id, lots, lot_move_data, damage_location_id, results, journal, group_key, entry)
+    for _, source_picking_id, lots, group_key, entry in groups
+  ]
+  if CONFIG['return_max_workers'] > 1 and len(groups) > 1:
+    executor = get_return_executor(CONFIG['return_max_workers'])
+    futures = [executor.submit(prepare_return_group, *args) for args in group_calls]
+    new_picking_ids = []
+    for (_, _, lots, _, _), future in zip(groups, futures):
+      try:
+        new_picking_ids.append(future.result())
+      except Exception as e:
+        new_picking_ids.append(None)
+        for lot in lots:
+          results[lot] = {'success': False, 'message': f"Error: {str(e)}"}
+      if progress:
+        progress.update(len(new_picking_ids), len(groups), f"Prepared {len(new_picking_ids)} of {len(groups)} return groups...")
+  else:
+    new_picking_ids = []
+    for args in group_calls:
+      new_picking_ids.append(prepare_return_group(*args))
+      if progress:
+        progress.update(len(new_picking_ids), len(groups), f"Prepared {len(new_picking_ids)} of {len(groups)} return groups...")
+
+  # Validate every prepared return picking in one pass and report back per lot
+  prepared = [
+    (po_number, lots, group_key, new_picking_id)
+    for (po_number, _, lots, group_key, _), new_picking_id in zip(groups, new_picking_ids) if new_picking_id
+  ]
+  if progress:
+    progress.status(f"Validating {len(prepared)} return pickings...")
+  try:
+    outcomes = validate_return_pickings(models, uid, [new_picking_id for _, _, _, new_picking_id in prepared], progress)
+  except Exception as e:
+    outcomes = {new_picking_id: {'success': False, 'message': f"Error: {str(e)}"} for _, _, _, new_picking_id in prepared}
+
+  for po_number, lots, group_key, new_picking_id in prepared:
+    outcome = outcomes[new_picking_id]
+    if outcome['success']:
+      journal.record(group_key, lots, 'validated', picking_id=new_picking_id,
+                     returned_reference=outcome['returned_reference'])
+      validated_groups.append(group_key)
+    for lot in lots:
+      results[lot] = {'po_number': po_number, 'new_picking_id': new_picking_id, **outcome}
 
   # Summary
   success_count = sum(1 for r in results.values() if r['success'])
@@ -1088,10 +2055,435 @@ def process_product_return(lot_serials):
     "results": results,
     "success_count": success_count,
     "failure_count": failure_count,
-    "message": message
+    "message": message,
+    "validated_groups": validated_groups # journal entries to close once the results are applied
   }
 
-def create_excel_report(non_damaged, damaged, approved, rejected, processed):
+def plan_product_return(lot_serials, resume=False):
+  """Dry run of process_product_return: groups, pickings, RPC calls per type and estimated wall time.
+
+  Uses the lot resolution index, the return journal and the call latencies
+  measured by the connection pool; nothing is written to Odoo. Calls that
+  depend on Odoo's answer (line unlinks, wizard handling) are counted as
+  upper bounds.
+  """
+  unique_lots = sorted(set(lot_serials))
+  failures, lot_groups, lot_move_data = group_return_lots(unique_lots)
+  journal = ReturnJournal(CONFIG['return_journal_path'])
+  models = st.session_state.models
+
+  def latency(model, method):
+    return models.latency(model, method, CONFIG['default_rpc_latency'])
+
+  rpc_calls = Counter()
+  group_rows = []
+  group_seconds = []
+  pickings_to_validate = 0
+
+  group_keys = {
+    (po_number, key): ReturnJournal.group_key(po_number, lot_move_data[lots[0]]['picking_id'][0], lots)
+    for (po_number, key), lots in lot_groups.items()
+  }
+  entries = {}
+  if resume:
+    # Same check against Odoo as a real resumed run (read only; the journal is not updated)
+    entries = reconcile_journal_entries(models, st.session_state.uid,
+                                        {group_key: journal.get(group_key) for group_key in group_keys.values()})
+    rpc_calls[('stock.picking', 'search_read')] += 1
+
+  for (po_number, key), lots in lot_groups.items():
+    source_picking_id = lot_move_data[lots[0]]['picking_id'][0]
+    entry = entries.get(group_keys[(po_number, key)])
+    stage = entry['stage'] if entry else None
+    product_qty = Counter(lot_move_data[lot]['product_id'][0] for lot in lots)
+    distinct_qtys = len(set(product_qty.values()))
+
+    calls = Counter()
+    if stage == 'wizard_created':
+      calls[('stock.return.picking', 'search')] += 1
+    if stage in (None, 'wizard_created'):
+      calls[('stock.return.picking', 'create')] += 1 # resumed wizards only when Odoo has vacuumed them
+    if stage in (None, 'wizard_created'):
+      calls[('stock.return.picking.line', 'search_read')] += 1
+      calls[('stock.return.picking.line', 'write')] += distinct_qtys
+      calls[('stock.return.picking.line', 'unlink')] += 1
+      calls[('stock.return.picking', 'create_returns')] += 1
+    if stage in (None, 'wizard_created', 'picking_created'):
+      calls[('stock.picking', 'write')] += 1
+      calls[('stock.move', 'search_read')] += 1
+      calls[('stock.move', 'write')] += distinct_qtys
+      calls[('stock.move.line', 'search')] += 1
+      calls[('stock.move.line', 'unlink')] += 1
+      calls[('stock.move.line', 'create')] += 1
+    if stage != 'validated':
+      pickings_to_validate += 1
+
+    seconds = sum(count * latency(model, method) for (model, method), count in calls.items())
+    rpc_calls.update(calls)
+    group_seconds.append(seconds)
+
+    group_rows.append({
+      'PO Number': po_number,
+      'Source Picking': lot_move_data[lots[0]]['picking_id'][1],
+      'Lots': len(lots),
+      'Products': len(product_qty),
+      'Journal Stage': stage or 'new',
+      'RPC Calls': sum(calls.values()),
+      'Est. Seconds': round(seconds, 1),
+    })
+
+  # Groups are prepared concurrently, then all pickings are validated together
+  workers = max(1, min(CONFIG['return_max_workers'], len(group_seconds) or 1))
+  prepare_seconds = max(max(group_seconds, default=0), sum(group_seconds) / workers)
+  validate_seconds = 0
+  if pickings_to_validate:
+    validation_calls = {
+      ('stock.picking', 'button_validate'): 1,
+      ('stock.immediate.transfer', 'search'): 1,
+      ('stock.immediate.transfer', 'process'): 1,
+      ('stock.picking', 'read'): 1,
+    }
+    rpc_calls.update(validation_calls)
+    # Bulk validation work grows with the number of pickings in the call
+    validate_seconds = (
+      latency('stock.picking', 'button_validate') * pickings_to_validate
+      + latency('stock.immediate.transfer', 'search')
+      + latency('stock.immediate.transfer', 'process') * pickings_to_validate
+      + latency('stock.picking', 'read')
+    )
+
+  return {
+    'groups': group_rows,
+    'rpc_calls': [
+      {'Model': model, 'Method': method, 'Calls': count}
+      for (model, method), count in sorted(rpc_calls.items())
+    ],
+    'total_calls': sum(rpc_calls.values()),
+    'pickings': pickings_to_validate,
+    'estimated_seconds': prepare_seconds + validate_seconds + (latency('stock.picking', 'search_read') if resume else 0),
+    'failures': failures,
+  }
+
+class Job:
+  """A background check or return run: status, progress counters and result"""
+
+  def __init__(self, job_id, kind, label, session_id):
+    self.id = job_id
+    self.kind = kind
+    self.label = label
+    self.session_id = session_id
+    self.status = 'queued'
+    self.done = 0
+    self.total = 0
+    self.message = 'Waiting for a free worker...'
+    self.errors = []
+    self.result = None
+    self.partial = None # results published so far by streaming jobs
+    self.version = 0 # bumped each time `partial` changes
+    self.applied_version = 0
+    self.applied = False
+    self.cancelled = False # set by the page; the job stops at its next checkpoint
+    self.created_at = datetime.now()
+    self.finished_at = None # time.monotonic() when the job stopped running
+
+  @property
+  def active(self):
+    return self.status in ('queued', 'running')
+
+class JobRunner:
+  """Process-wide queue of background jobs that outlive Streamlit reruns.
+
+  Jobs run on a bounded worker pool with the submitting session's script
+  context attached, so they can use st.session_state but never draw UI;
+  the page polls their counters instead.
+  """
+
+  def __init__(self, max_workers, history, ttl):
+    self.history = history
+    self.ttl = ttl
+    self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='inventory-job')
+    self._jobs = OrderedDict()
+    self._lock = threading.Lock()
+
+  def submit(self, kind, label, fn, *args):
+    ctx = get_script_run_ctx()
+    with self._lock:
+      job = Job(f"{kind}-{uuid.uuid4().hex[:8]}", kind, label, ctx.session_id)
+      self._jobs[job.id] = job
+      self._trim(ctx.session_id)
+
+    def run():
+      if job.cancelled:
+        job.status = 'cancelled'
+        job.message = 'Cancelled'
+        job.finished_at = time.monotonic()
+        return
+      add_script_run_ctx(threading.current_thread(), ctx)
+      job.status = 'running'
+      job.message = 'Starting...'
+      try:
+        job.result = fn(job, *args)
+        job.status = 'cancelled' if job.cancelled else 'done'
+        job.message = 'Cancelled' if job.cancelled else 'Completed'
+      except Exception as e:
+        job.status = 'failed'
+        job.message = f"Failed: {str(e)}"
+      finally:
+        job.finished_at = time.monotonic()
+
+    self._pool.submit(run)
+    return job
+
+  def _trim(self, session_id):
+    finished = [j for j in self._jobs.values() if j.session_id == session_id and not j.active]
+    for job in finished[:max(0, len(finished) - self.history)]:
+      del self._jobs[job.id]
+    self._evict_expired()
+
+  def _evict_expired(self):
+    """Drop finished jobs older than the TTL from every session, including sessions that are gone"""
+    cutoff = time.monotonic() - self.ttl
+    for job in [j for j in self._jobs.values() if j.finished_at is not None and j.finished_at < cutoff]:
+      del self._jobs[job.id]
+
+  def jobs_for(self, session_id):
+    with self._lock:
+      self._evict_expired()
+      return [job for job in self._jobs.values() if job.session_id == session_id]
+
+@st.cache_resource
+def get_job_runner(max_workers, history, ttl):
+  """Background job runner shared by every session in this process"""
+  return JobRunner(max_workers, history, ttl)
+
+def job_runner():
+  return get_job_runner(CONFIG['job_workers'], CONFIG['job_history'], CONFIG['job_ttl'])
+
+def session_jobs():
+  """Jobs submitted from the current browser session"""
+  return job_runner().jobs_for(get_script_run_ctx().session_id)
+
+def run_check_job(job, lot_serials):
+  """Background inventory check that publishes classified lots and their POs chunk by chunk"""
+  job.total = len(lot_serials)
+  job.partial = {'store': LotResultStore(), 'lot_po_mapping': {}}
+
+  for chunk_non_damaged, chunk_damaged in check_inventory_stream(lot_serials, progress=ProgressReporter(job)):
+    # New containers each chunk, so the page never reads a half-updated table
+    job.partial = {
+      'store': job.partial['store'].extend(chunk_non_damaged, chunk_damaged),
+      'lot_po_mapping': {
+        **job.partial['lot_po_mapping'],
+        **{item['lot']: get_po_for_lot(item['lot']) for item in chunk_damaged}
+      },
+    }
+    job.version += 1
+    if job.cancelled:
+      break
+
+  return job.partial
+
+def run_return_job(job, lot_serials, resume):
+  """Background return processing for a snapshot of approved lots"""
+  job.total = len(lot_serials)
+  success, result = process_product_return(lot_serials, resume=resume, progress=ProgressReporter(job, unit='groups'))
+  return {'lots': lot_serials, 'success': success, 'result': result}
+
+def latest_check_job(jobs):
+  """The most recently submitted check; only its results are shown, earlier checks are superseded"""
+  checks = [job for job in jobs if job.kind == 'check']
+  return checks[-1] if checks else None
+
+def cancel_check_jobs():
+  """Stop this session's queued and running checks so they never publish into cleared results"""
+  for job in session_jobs():
+    if job.kind == 'check' and job.active:
+      job.cancelled = True
+      job.message = 'Cancelling...'
+
+def has_unapplied_results(job, latest_check):
+  if job.cancelled or (job.kind == 'check' and job is not latest_check):
+    return False
+  return (job.status == 'done' and not job.applied) or (job.kind == 'check' and job.version > job.applied_version)
+
+def archive_reviewed_results():
+  """Keep the rows of reviewed lots before the current results are replaced"""
+  store = st.session_state.inventory_results
+  if store is None:
+    return
+  lot_status = st.session_state.lot_status
+  reviewed = [lot for lot in store.frame['lot'] if lot_status.status(lot) not in (None, 'pending')]
+  st.session_state.lot_history = st.session_state.lot_history.merge(store.subset(reviewed))
+
+def lot_records(lots):
+  """Result rows for any lots reviewed this session, from the current results or earlier analyses"""
+  history, current = st.session_state.lot_history, st.session_state.inventory_results
+  if current is None:
+    return history.lookup(lots)
+  # Merged once per pair of stores, like the result tables
+  store = cached_table('lot_records', (history.token, current.token), lambda: history.merge(current))
+  return store.lookup(lots)
+
+def apply_check_results(job, results):
+  if st.session_state.results_job_id != job.id:
+    archive_reviewed_results()
+    st.session_state.results_job_id = job.id
+  st.session_state.inventory_results = results['store']
+  st.session_state.damaged_lots = results['store'].lots(damaged=True)
+  st.session_state.lot_status.sync_pending(st.session_state.damaged_lots)
+  st.session_state.lot_po_mapping = results['lot_po_mapping']
+
+def apply_finished_jobs():
+  """Copy job results into session state on the script thread: partial chunks of running checks, then final results once"""
+  jobs = session_jobs()
+  latest_check = latest_check_job(jobs)
+  for job in jobs:
+    if job.cancelled or (job.kind == 'check' and job is not latest_check):
+      # Cancelled and superseded checks are never shown; free their results once they stop
+      if not job.active:
+        job.partial = job.result = None
+      continue
+
+    if job.kind == 'check' and job.status != 'done' and job.version > job.applied_version:
+      job.applied_version = job.version
+      apply_check_results(job, job.partial)
+      continue
+
+    if job.status == 'failed':
+      job.partial = None # its last chunk is already applied
+      continue
+
+    if job.status != 'done' or job.applied:
+      continue
+    job.applied = True
+    job.applied_version = job.version
+
+    if job.kind == 'check':
+      apply_check_results(job, job.result)
+      # Session state now holds the results; the runner keeps only the job's status
+      job.partial = job.result = None
+
+    elif job.kind == 'returns':
+      success, result = job.result['success'], job.result['result']
+      st.session_state.return_results = job.result
+      if success:
+        returned = []
+        for lot in job.result['lots']:
+          if lot in result['results'] and result['results'][lot]['success']:
+            returned.append(lot)
+            st.session_state.processed_lots[lot] = {
+              'status': 'Return Processed',
+              'po_number': result['results'][lot].get('po_number', 'N/A'),
+              'new_picking_id': result['results'][lot].get('new_picking_id', 'N/A'),
+              'returned_reference': result['results'][lot].get('returned_reference', 'N/A'),
+              'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+        # ✅ Submitted lots leave the approvals: returned ones as processed, failed ones back to pending
+        # if they are in the current results, untracked otherwise (lots approved while the job ran stay approved)
+        lot_status = st.session_state.lot_status
+        lot_status.set(returned, 'processed')
+        failed = [lot for lot in job.result['lots'] if lot_status.has(lot, 'approved')]
+        current = set(st.session_state.damaged_lots)
+        lot_status.set([lot for lot in failed if lot in current], 'pending')
+        lot_status.discard([lot for lot in failed if lot not in current])
+        st.session_state.return_plan = None
+
+        # The returns are recorded in this session now; only unfinished groups stay resumable
+        ReturnJournal(CONFIG['return_journal_path']).close(result['validated_groups'])
+      job.result = None
+
+@st.fragment(run_every=2)
+def render_job_panel():
+  """Live status of this session's background jobs; reruns the page when new results arrive"""
+  jobs = session_jobs()
+  latest_check = latest_check_job(jobs)
+  if any(has_unapplied_results(job, latest_check) for job in jobs):
+    st.rerun()
+
+  visible = [job for job in jobs if job.active or job.status == 'failed' or job.errors]
+  if not visible:
+    return
+
+  st.markdown('<h3 class="section-header">⏱️ Background Jobs</h3>', unsafe_allow_html=True)
+  for job in reversed(visible):
+    icon = {'queued': '🕒', 'running': '🔄', 'done': '✅', 'failed': '❌', 'cancelled': '⏹️'}[job.status]
+    st.markdown(f"**{icon} {job.label}** — {job.message}")
+    if job.active:
+      st.progress(job.done / job.total if job.total else 0.0)
+    for error in job.errors:
+      st.error(error)
+
+# Prices stay numeric in the result tables; Streamlit formats them for display
+PRICE_COLUMN_CONFIG = {
+  'Price': st.column_config.NumberColumn('Price', format="$%.2f"),
+  'Discount': st.column_config.NumberColumn('Discount', format="%.1f%%"),
+  'Cost Price': st.column_config.NumberColumn('Cost Price', format="$%.2f"),
+}
+
+REVIEW_STATUS_LABELS = {
+  'processed': '✅ Return Processed',
+  'approved': '📝 Approved for Return',
+  'rejected': '❌ Rejected for Return',
+}
+
+def cached_table(name, key, build):
+  """Return the table built for `key`, calling build() only when the key has changed"""
+  entry = st.session_state.table_cache.get(name)
+  if entry is None or entry[0] != key:
+    entry = (key, build())
+    st.session_state.table_cache[name] = entry
+  return entry[1]
+
+def build_non_damaged_table(store):
+  rows = store.rows(damaged=False)
+  return pd.DataFrame({
+    'Lot/Serial': rows['lot'],
+    'Location': rows['location'],
+    'Status': rows['status'],
+    'Reference': rows['reference'],
+    'Product': rows['product_name'],
+    'SKU': rows['sku'],
+    'Vendor': rows['vendor'],
+    'Price': rows['price_unit'],
+    'Discount': rows['discount'],
+    'Cost Price': rows['cost_price'],
+    'Available Qty': rows['available_qty'],
+  })
+
+def build_damaged_table(store, lot_status, lot_po_mapping):
+  rows = store.rows(damaged=True)
+  return pd.DataFrame({
+    'Lot/Serial': rows['lot'],
+    'Location': rows['location'],
+    'PO Number': rows['lot'].map(lambda lot: lot_po_mapping.get(lot, "Not Found")),
+    'Status': rows['lot'].map(lambda lot: REVIEW_STATUS_LABELS.get(lot_status.status(lot), '⏳ Pending Action')),
+    'Reference': rows['reference'],
+    'Product': rows['product_name'],
+    'SKU': rows['sku'],
+    'Vendor': rows['vendor'],
+    'Price': rows['price_unit'],
+    'Discount': rows['discount'],
+    'Cost Price': rows['cost_price'],
+    'Available Qty': rows['available_qty'],
+  })
+
+def reviewed_lots_sheet(lots, status):
+  """Rows of the Approved/Rejected Lots sheets"""
+  records = lot_records(lots)
+  return pd.DataFrame({
+    'lot': records.index,
+    'status': status,
+    'reference': records['reference'].values,
+    'product_name': records['product_name'].values,
+    'sku': records['sku'].values,
+    'vendor': records['vendor'].values,
+    'price_unit': records['price_unit'].values,
+    'discount': records['discount'].values,
+    'cost_price': records['cost_price'].values,
+  })
+
+def create_excel_report(store, lot_status, processed):
   """Create an Excel report with all the inventory data organized by sections"""
  
   # Create a BytesIO object to store the Excel file
@@ -1131,11 +2523,11 @@ def create_excel_report(non_damaged, damaged, approved, rejected, processed):
       'Category': ['Total Lots Checked', 'Non-Damaged Lots', 'Damaged Lots',
             'Approved for Return', 'Rejected for Return', 'Processed Returns'],
       'Count': [
-        len(non_damaged) + len(damaged),
-        len(non_damaged),
-        len(damaged),
-        len(approved),
-        len(rejected),
+        len(store.frame),
+        store.non_damaged_count,
+        store.damaged_count,
+        lot_status.count('approved'),
+        lot_status.count('rejected'),
         len(processed)
       ]
     }
@@ -1171,28 +2563,21 @@ def create_excel_report(non_damaged, damaged, approved, rejected, processed):
     # Create detailed sheets for each category
    
     # Non-Damaged Items sheet
-    if non_damaged:
-      non_damaged_data = []
-      for item in non_damaged:
-        details = item.get('details', {})
-        po_details = details.get('po_details', {}) if details else {}
-       
-        non_damaged_data.append({
-            'Lot/Serial': item['lot'],
-            'Location': item['location'],
-            'Status': item['status'],
-            'Reference': details.get('reference', 'N/A') if details else 'N/A',  # FIXED
-            'Product': details.get('product_name', 'N/A') if details else 'N/A',  # FIXED
-            'SKU': details.get('sku', 'N/A') if details else 'N/A',  # FIXED
-            'Vendor': po_details.get('vendor', 'N/A') if po_details else 'N/A',  # FIXED
-            'Price': f"${po_details.get('price_unit', 0):.2f}" if po_details else "$0.00",  # FIXED
-            'Discount': f"{po_details.get('discount', 0)}%" if po_details else "0%",  # FIXED
-            'Cost Price': f"${po_details.get('cost_price', 0):.2f}" if po_details else "$0.00",  # FIXED
-            'Available Qty': details.get('available_qty', 0) if details else 0,  # FIXED
-        })
-
-     
-      non_damaged_df = pd.DataFrame(non_damaged_data)
+    if store.non_damaged_count:
+      rows = store.rows(damaged=False)
+      non_damaged_df = pd.DataFrame({
+        'Lot/Serial': rows['lot'],
+        'Location': rows['location'],
+        'Status': rows['status'],
+        'Reference': rows['reference'],
+        'Product': rows['product_name'],
+        'SKU': rows['sku'],
+        'Vendor': rows['vendor'],
+        'Price': rows['price_unit'].map('${:.2f}'.format),
+        'Discount': rows['discount'].map('{}%'.format),
+        'Cost Price': rows['cost_price'].map('${:.2f}'.format),
+        'Available Qty': rows['available_qty'],
+      })
       non_damaged_df.to_excel(writer, sheet_name='Non-Damaged Items', index=False)
       worksheet = writer.sheets['Non-Damaged Items']
       for col_num, value in enumerate(non_damaged_df.columns.values):
@@ -1206,37 +2591,21 @@ def create_excel_report(non_damaged, damaged, approved, rejected, processed):
         worksheet.set_column(i, i, max_len)
    
     # Damaged Items sheet
-    if damaged:
-      damaged_data = []
-      for item in damaged:
-        details = item.get('details', {})
-        po_details = details.get('po_details', {}) if details else {}
-        lot = item['lot']
-       
-        if lot in processed:
-          status = 'Return Processed'
-        elif lot in approved:
-          status = 'Approved for Return'
-        elif lot in rejected:
-          status = 'Rejected for Return'
-        else:
-          status = 'Pending Action'
-         
-        damaged_data.append({
-            'lot': lot,
-            'location': item['location'],
-            'status': status,
-            'reference': details.get('reference', 'N/A') if details else 'N/A',
-            'product_name': details.get('product_name', 'N/A') if details else 'N/A',
-            'sku': details.get('sku', 'N/A') if details else 'N/A',
-            'vendor': po_details.get('vendor', 'N/A') if po_details else 'N/A',
-            'price_unit': po_details.get('price_unit', 0) if po_details else 0,
-            'discount': po_details.get('discount', 0) if po_details else 0,
-            'cost_price': po_details.get('cost_price', 0) if po_details else 0,
-            'Available Qty': details.get('available_qty', 0) if details else 0,  # FIXED THIS LINE
-        })
-     
-      damaged_df = pd.DataFrame(damaged_data)
+    if store.damaged_count:
+      rows = store.rows(damaged=True)
+      damaged_df = pd.DataFrame({
+        'lot': rows['lot'],
+        'location': rows['location'],
+        'status': rows['lot'].map(lambda lot: LOT_STATUS_LABELS.get(lot_status.status(lot), 'Pending Action')),
+        'reference': rows['reference'],
+        'product_name': rows['product_name'],
+        'sku': rows['sku'],
+        'vendor': rows['vendor'],
+        'price_unit': rows['price_unit'],
+        'discount': rows['discount'],
+        'cost_price': rows['cost_price'],
+        'Available Qty': rows['available_qty'],
+      })
       damaged_df.to_excel(writer, sheet_name='Damaged Items', index=False)
       worksheet = writer.sheets['Damaged Items']
       for col_num, value in enumerate(damaged_df.columns.values):
@@ -1252,9 +2621,9 @@ def create_excel_report(non_damaged, damaged, approved, rejected, processed):
     # Processed Returns sheet
     if processed:
       processed_data = []
+      records = lot_records(list(processed))
       for lot, details in processed.items():
-        lot_details = st.session_state.lot_details.get(lot, {})
-        po_details = lot_details.get('po_details', {}) if lot_details else {}
+        record = records.loc[lot]
        
         processed_data.append({
           'lot': lot,
@@ -1262,14 +2631,14 @@ def create_excel_report(non_damaged, damaged, approved, rejected, processed):
           'picking_id': details.get('new_picking_id', 'N/A') if details else 'N/A',  # FIXED
           'status': 'Return Processed',
           'timestamp': details.get('timestamp', 'N/A') if details else 'N/A',  # FIXED
-          'product_name': lot_details.get('product_name', 'N/A') if lot_details else 'N/A',
-          'sku': lot_details.get('sku', 'N/A') if lot_details else 'N/A',
-          'vendor': po_details.get('vendor', 'N/A') if po_details else 'N/A',
-          'reference': lot_details.get('reference', 'N/A') if lot_details else 'N/A',
+          'product_name': record['product_name'],
+          'sku': record['sku'],
+          'vendor': record['vendor'],
+          'reference': record['reference'],
           'returned_reference': details.get('returned_reference', 'N/A') if details else 'N/A',  # FIXED
-          'price_unit': po_details.get('price_unit', 0) if po_details else 0,
-          'discount': po_details.get('discount', 0) if po_details else 0,
-          'cost_price': po_details.get('cost_price', 0) if po_details else 0
+          'price_unit': record['price_unit'],
+          'discount': record['discount'],
+          'cost_price': record['cost_price']
         })     
 
       processed_df = pd.DataFrame(processed_data)
@@ -1286,26 +2655,8 @@ def create_excel_report(non_damaged, damaged, approved, rejected, processed):
         worksheet.set_column(i, i, max_len)
    
     # Approved Lots sheet
-    if approved:
-      approved_data = []
-      for lot in approved:
-        lot_details = st.session_state.lot_details.get(lot, {})
-        po_details = lot_details.get('po_details', {}) if lot_details else {}
-       
-        approved_data.append({
-          'lot': lot,
-          'status': 'Approved for Return',
-          'reference': lot_details.get('reference', 'N/A') if lot_details else 'N/A',
-          'product_name': lot_details.get('product_name', 'N/A') if lot_details else 'N/A',
-          'sku': lot_details.get('sku', 'N/A') if lot_details else 'N/A',
-          'vendor': po_details.get('vendor', 'N/A') if po_details else 'N/A',
-          'price_unit': po_details.get('price_unit', 0) if po_details else 0,
-          'discount': po_details.get('discount', 0) if po_details else 0,
-          'cost_price': po_details.get('cost_price', 0) if po_details else 0,
-          
-        })
-     
-      approved_df = pd.DataFrame(approved_data)
+    if lot_status.count('approved'):
+      approved_df = reviewed_lots_sheet(lot_status.lots('approved'), 'Approved for Return')
       approved_df.to_excel(writer, sheet_name='Approved Lots', index=False)
       worksheet = writer.sheets['Approved Lots']
       for col_num, value in enumerate(approved_df.columns.values):
@@ -1319,25 +2670,8 @@ def create_excel_report(non_damaged, damaged, approved, rejected, processed):
         worksheet.set_column(i, i, max_len)
    
     # Rejected Lots sheet
-    if rejected:
-      rejected_data = []
-      for lot in rejected:
-        lot_details = st.session_state.lot_details.get(lot, {})
-        po_details = lot_details.get('po_details', {}) if lot_details else {}
-       
-        rejected_data.append({
-          'lot': lot,
-          'status': 'Rejected for Return',
-          'reference': lot_details.get('reference', 'N/A') if lot_details else 'N/A',
-          'product_name': lot_details.get('product_name', 'N/A') if lot_details else 'N/A',
-          'sku': lot_details.get('sku', 'N/A') if lot_details else 'N/A',
-          'vendor': po_details.get('vendor', 'N/A') if po_details else 'N/A',
-          'price_unit': po_details.get('price_unit', 0) if po_details else 0,
-          'discount': po_details.get('discount', 0) if po_details else 0,
-          'cost_price': po_details.get('cost_price', 0) if po_details else 0
-        })
-     
-      rejected_df = pd.DataFrame(rejected_data)
+    if lot_status.count('rejected'):
+      rejected_df = reviewed_lots_sheet(lot_status.lots('rejected'), 'Rejected for Return')
       rejected_df.to_excel(writer, sheet_name='Rejected Lots', index=False)
       worksheet = writer.sheets['Rejected Lots']
       for col_num, value in enumerate(rejected_df.columns.values):
@@ -1354,20 +2688,28 @@ def create_excel_report(non_damaged, damaged, approved, rejected, processed):
   output.seek(0)
   return output.getvalue()
 
-def create_visualization_charts(non_damaged, damaged, approved, rejected, processed):
+def inventory_counts(store, lot_status):
+  """Counts shown by the metric cards and charts, without scanning the results"""
+  counts = lot_status.counts()
+  counts['non_damaged'] = store.non_damaged_count
+  counts['damaged'] = store.damaged_count
+  counts['total'] = counts['non_damaged'] + counts['damaged']
+  return counts
+
+def create_visualization_charts(counts):
   """Create interactive visualization charts for the inventory data"""
  
   # Prepare data for charts
-  total_checked = len(non_damaged) + len(damaged)
+  total_checked = counts['total']
  
   # Pie chart for inventory status distribution (SMALLER SIZE)
   labels = ['Non-Damaged', 'Damaged - Pending', 'Approved for Return', 'Rejected', 'Processed Returns']
   values = [
-    len(non_damaged),
-    len([lot for lot in damaged if lot['lot'] not in approved and lot['lot'] not in rejected and lot['lot'] not in processed]),
-    len(approved),
-    len(rejected),
-    len(processed)
+    counts['non_damaged'],
+    counts['pending'],
+    counts['approved'],
+    counts['rejected'],
+    counts['processed']
   ]
  
   colors = ['#28a745', '#ffc107', '#007bff', '#dc3545', '#6f42c1']
@@ -1408,7 +2750,7 @@ def create_visualization_charts(non_damaged, damaged, approved, rejected, proces
   # Bar chart for workflow status (ORIGINAL SIZE)
   workflow_data = {
     'Status': ['Total Checked', 'Damaged Items', 'Approved', 'Rejected', 'Processed'],
-    'Count': [total_checked, len(damaged), len(approved), len(rejected), len(processed)]
+    'Count': [total_checked, counts['damaged'], counts['approved'], counts['rejected'], counts['processed']]
   }
  
   fig_bar = px.bar(
@@ -1441,11 +2783,12 @@ def create_visualization_charts(non_damaged, damaged, approved, rejected, proces
  
   return fig_pie, fig_bar
 
-def display_enhanced_metrics(non_damaged, damaged, approved, rejected, processed):
+def display_enhanced_metrics(counts):
   """Display enhanced metrics with professional styling"""
  
-  total_checked = len(non_damaged) + len(damaged)
-  processing_rate = (len(approved) + len(rejected) + len(processed)) / len(damaged) * 100 if damaged else 0
+  total_checked = counts['total']
+  decided = counts['approved'] + counts['rejected'] + counts['processed']
+  processing_rate = decided / counts['damaged'] * 100 if counts['damaged'] else 0
  
   col1, col2, col3, col4 = st.columns(4)
  
@@ -1462,7 +2805,7 @@ def display_enhanced_metrics(non_damaged, damaged, approved, rejected, processed
     st.markdown(f"""
     <div class="metric-card">
       <div class="metric-title">⚠️ Damaged Items</div>
-      <div class="metric-value">{len(damaged):,}</div>
+      <div class="metric-value">{counts['damaged']:,}</div>
       <div style="font-size: 0.8rem; color: #dc3545;">Requires Action</div>
     </div>
     """, unsafe_allow_html=True)
@@ -1477,8 +2820,7 @@ def display_enhanced_metrics(non_damaged, damaged, approved, rejected, processed
     """, unsafe_allow_html=True)
  
   with col4:
-    pending_count = len([item for item in damaged if item['lot'] not in approved and
-              item['lot'] not in rejected and item['lot'] not in processed])
+    pending_count = counts['pending']
     st.markdown(f"""
     <div class="metric-card">
       <div class="metric-title">⏳ Pending Action</div>
@@ -1487,6 +2829,205 @@ def display_enhanced_metrics(non_damaged, damaged, approved, rejected, processed
     </div>
     """, unsafe_allow_html=True)
 
+@st.fragment
+def render_bulk_actions(lot_status):
+  """Selection and approve/reject controls; selecting reruns only this section"""
+  st.markdown('<div class="action-panel">', unsafe_allow_html=True)
+  st.markdown('<div class="action-title">🎯 Bulk Actions</div>', unsafe_allow_html=True)
+
+  # Get lots that are pending action
+  pending_lots = lot_status.lots('pending')
+
+  if pending_lots:
+    st.markdown(f"**{len(pending_lots)}** items are awaiting your decision")
+
+    # Button-based Select All/Clear All
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+      if st.button("Select All", use_container_width=True):
+        st.session_state.selected_damaged_lots = pending_lots
+        st.rerun(scope="fragment")
+
+    with col2:
+      if st.button("Clear All", use_container_width=True):
+        st.session_state.selected_damaged_lots = []
+        st.rerun(scope="fragment")
+
+    with col3:
+      st.markdown(f"**Selected:** {len(st.session_state.selected_damaged_lots)}")
+
+    if st.session_state.selected_damaged_lots:
+      st.info(f"💡 {len(st.session_state.selected_damaged_lots)} item(s) selected for action")
+
+      # Action buttons with enhanced styling
+      col1, col2, col3 = st.columns(3)
+
+      # Approving or rejecting changes the metrics, tables and return center, so those rerun the page
+      with col1:
+        if st.button(
+          f"✅ Approve Selected ({len(st.session_state.selected_damaged_lots)})",
+          type="primary",
+          use_container_width=True
+        ):
+          lot_status.set(st.session_state.selected_damaged_lots, 'approved')
+          st.toast(f"✅ Approved {len(st.session_state.selected_damaged_lots)} items for return!")
+          st.session_state.selected_damaged_lots = []
+          st.rerun()
+
+      with col2:
+        if st.button(
+          f"❌ Reject Selected ({len(st.session_state.selected_damaged_lots)})",
+          use_container_width=True
+        ):
+          lot_status.set(st.session_state.selected_damaged_lots, 'rejected')
+          st.toast(f"❌ Rejected {len(st.session_state.selected_damaged_lots)} items!")
+          st.session_state.selected_damaged_lots = []
+          st.rerun()
+
+      with col3:
+        if st.button("🔄 Clear Selection", use_container_width=True):
+          st.session_state.selected_damaged_lots = []
+          st.session_state.select_all_damaged = False
+          st.rerun(scope="fragment")
+  else:
+    st.success("🎉 All damaged items have been processed!")
+
+  st.markdown('</div>', unsafe_allow_html=True)
+
+def build_approved_table(approved_lots):
+  return pd.DataFrame({
+    'Lot/Serial': approved_lots,
+    'PO Number': [st.session_state.lot_po_mapping.get(lot, "Not Found") for lot in approved_lots],
+    'Available Qty': lot_records(approved_lots)['available_qty'].values,
+    'Status': 'Approved for Return'
+  })
+
+@st.fragment
+def render_return_center(store, lot_status):
+  """Approved lots, return submission and the dry run plan; its widgets rerun only this section"""
+  # Process approved returns section
+  approved_lots = lot_status.lots('approved')
+  if approved_lots:
+    st.markdown("---")
+    st.markdown('<h3 class="section-header">🔄 Return Processing Center</h3>', unsafe_allow_html=True)
+
+    st.markdown(f"""
+    <div class="status-card info-card">
+      <h4>📋 Ready for Processing</h4>
+      <p><strong>{len(approved_lots)}</strong> lot(s) have been approved and are ready for return processing.</p>
+      <p><strong>Next Step:</strong> Click the button below to process all approved returns.</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+  # --- Show Approved Items Section ---
+  with st.expander("📋 View Approved Items", expanded=False):
+    approved_df = cached_table(
+      'approved', (store.token, st.session_state.lot_history.token, lot_status.version),
+      lambda: build_approved_table(approved_lots)
+    )
+    st.dataframe(approved_df, use_container_width=True)
+
+  # --- Process Returns Section ---
+  col1, col2 = st.columns([2, 1])
+
+  with col1:
+    resume_returns = st.checkbox(
+      "♻️ Resume from return journal",
+      value=True,
+      help="Skip stages already completed by an interrupted run instead of creating duplicate return pickings"
+    )
+    button_label = f"🚀 Process Returns for All Approved Lots ({len(approved_lots)})"
+    process_button = st.button(button_label, type="primary", use_container_width=True)
+
+    if process_button:
+      if any(job.kind == 'returns' and job.active for job in session_jobs()):
+        st.error("⚠️ Return processing already initiated. Please wait for the running job to finish.")
+      elif not approved_lots:
+        st.warning("No approved lots found to process.")
+      else:
+        # ✅ Runs in the background on a snapshot of the approved lots
+        job_runner().submit(
+          'returns', f"Return processing ({len(approved_lots):,} lots)",
+          run_return_job, approved_lots, resume_returns
+        )
+        st.rerun()
+
+    # ✅ Summary of the last finished return job
+    if st.session_state.return_results:
+      success, result = st.session_state.return_results['success'], st.session_state.return_results['result']
+      if success:
+        st.markdown(f"""
+        <div class="status-card success-card">
+          <h4>🎉 Processing Complete!</h4>
+          <p><strong>✅ Successful:</strong> {result['success_count']} returns processed</p>
+          <p><strong>❌ Failed:</strong> {result['failure_count']} returns failed</p>
+        </div>
+        """, unsafe_allow_html=True)
+
+        # ✅ Show failed results if any
+        if result['failure_count'] > 0:
+          with st.expander("❌ View Failed Returns"):
+            for lot, res in result['results'].items():
+              if not res['success']:
+                st.error(f"**{lot}:** {res.get('message', 'No error message provided.')}")
+      else:
+        st.error(f"❌ Return processing failed: {result}")
+
+  with col2:
+    if st.button("🧮 Dry Run Plan", use_container_width=True, disabled=not approved_lots):
+      with st.spinner("🧮 Planning returns..."):
+        try:
+          st.session_state.return_plan = plan_product_return(
+            approved_lots, resume=resume_returns
+          )
+        except Exception as e:
+          st.error(f"❌ Could not plan returns: {str(e)}")
+    if st.button("📋 View Details", use_container_width=True):
+      st.info("Details view coming soon.")
+
+  # --- Dry run plan (nothing is written to Odoo) ---
+  if st.session_state.get('return_plan'):
+    plan = st.session_state.return_plan
+    with st.expander("🧮 Return Dry Run Plan", expanded=True):
+      plan_col1, plan_col2, plan_col3, plan_col4 = st.columns(4)
+      plan_col1.metric("Groups", len(plan['groups']))
+      plan_col2.metric("Pickings to Validate", plan['pickings'])
+      plan_col3.metric("RPC Calls", f"{plan['total_calls']:,}")
+      plan_col4.metric("Est. Duration", f"{plan['estimated_seconds'] / 60:.1f} min")
+      if plan['groups']:
+        st.dataframe(pd.DataFrame(plan['groups']), use_container_width=True)
+      if plan['rpc_calls']:
+        st.dataframe(pd.DataFrame(plan['rpc_calls']), use_container_width=True)
+      for lot, res in plan['failures'].items():
+        st.warning(f"**{lot}:** {res['message']}")
+
+@st.fragment
+def render_report_download(store, lot_status):
+  """Excel report, built once on request and reused until the results or review statuses change"""
+  report_key = (store.token, st.session_state.lot_history.token, lot_status.version, len(st.session_state.processed_lots))
+  entry = st.session_state.table_cache.get('excel_report')
+
+  if entry is None or entry[0] != report_key:
+    if not st.button("📊 Prepare Excel Report", use_container_width=True):
+      return
+    with st.spinner("📊 Building Excel report..."):
+      excel_data = cached_table(
+        'excel_report', report_key,
+        lambda: create_excel_report(store, lot_status, st.session_state.processed_lots)
+      )
+  else:
+    excel_data = entry[1]
+
+  # Enhanced download button
+  st.download_button(
+    label="⬇️ Download Excel Report",
+    data=excel_data,
+    file_name=f"inventory_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    use_container_width=True
+  )
+
 # Main app layout
 st.markdown('<h1 class="main-header fade-in-up">📦 Odoo Inventory Management</h1>', unsafe_allow_html=True)
 st.markdown('<p class="subtitle">Inventory tracking and returns processing system</p>', unsafe_allow_html=True)
@@ -1594,6 +3135,27 @@ with st.sidebar:
         <br><small>System ready for operations</small>
       </div>
       """, unsafe_allow_html=True)
+
+      # Shared master data cache (products, templates, vendors, PO lines)
+      cache_stats = master_data_cache().stats()
+      lookups = cache_stats['hits'] + cache_stats['misses']
+      hit_rate = cache_stats['hits'] / lookups * 100 if lookups else 0
+      st.caption(
+        f"🗄️ Master data cache: {cache_stats['size']:,} records • "
+        f"{cache_stats['hits']:,} hits / {cache_stats['misses']:,} misses ({hit_rate:.0f}%)"
+      )
+      if st.button("♻️ Invalidate Master Data Cache", use_container_width=True):
+        master_data_cache().invalidate()
+        st.success("✅ Master data cache cleared")
+
+      if st.button("📍 Refresh Company & Locations", use_container_width=True):
+        try:
+          if resolve_reference_locations():
+            st.success("✅ Damage/Stock location refreshed")
+          else:
+            st.warning("⚠️ Damage location 'Damge/Stock' not found in Odoo")
+        except Exception as e:
+          st.error(f"❌ Refresh failed: {str(e)}")
      
     else:
       st.markdown("""
@@ -1704,22 +3266,9 @@ else:
                   lot_serials.append(line.strip())
            
             if lot_serials:
-              with st.spinner("🔍 Analyzing inventory status..."):
-                non_damaged, damaged = check_inventory(lot_serials)
-                st.session_state.inventory_results = {
-                  'non_damaged': non_damaged,
-                  'damaged': damaged
-                }
-                st.session_state.damaged_lots = [item['lot'] for item in damaged]
-               
-                # Get PO numbers for damaged lots
-                st.session_state.lot_po_mapping = {}
-                for item in damaged:
-                  lot = item['lot']
-                  po_number = get_po_for_lot(lot)
-                  st.session_state.lot_po_mapping[lot] = po_number
-                 
-              st.success(f"✅ Successfully processed {len(lot_serials)} lot numbers!")
+              # Runs in the background so reruns do not cancel it
+              job_runner().submit('check', f"Inventory check ({len(lot_serials):,} lots)", run_check_job, lot_serials)
+              st.success(f"✅ Queued {len(lot_serials)} lot numbers for analysis!")
               st.rerun()
             else:
               st.error("Please enter at least one valid lot/serial number")
@@ -1759,49 +3308,43 @@ else:
               st.dataframe(df.head(10), use_container_width=True)
            
             if st.button("🔍 Check Inventory Status", type="primary", key="check_file"):
-              with st.spinner("🔍 Processing Excel file data..."):
-                non_damaged, damaged = check_inventory(lot_serials)
-                st.session_state.inventory_results = {
-                  'non_damaged': non_damaged,
-                  'damaged': damaged
-                }
-                st.session_state.damaged_lots = [item['lot'] for item in damaged]
-               
-                # Get PO numbers for damaged lots
-                st.session_state.lot_po_mapping = {}
-                for item in damaged:
-                  lot = item['lot']
-                  po_number = get_po_for_lot(lot)
-                  st.session_state.lot_po_mapping[lot] = po_number
-                 
-              st.success(f"✅ Successfully processed {len(lot_serials)} lot numbers from Excel!")
+              # Runs in the background so reruns do not cancel it
+              job_runner().submit('check', f"Excel check: {uploaded_file.name} ({len(lot_serials):,} lots)", run_check_job, lot_serials)
+              st.success(f"✅ Queued {len(lot_serials)} lot numbers from Excel for analysis!")
               st.rerun()
           else:
             st.error("❌ Excel file must contain a column with 'Lot' or 'Serial' in the name")
         except Exception as e:
           st.error(f"❌ Error reading Excel file: {str(e)}")
    
+    # Background jobs: live progress, and results copied in as jobs finish
+    apply_finished_jobs()
+    render_job_panel()
+
     # Display results if available
     if st.session_state.inventory_results is not None:
-      if isinstance(st.session_state.inventory_results, dict) and 'non_damaged' in st.session_state.inventory_results:
-        non_damaged = st.session_state.inventory_results['non_damaged']
-        damaged = st.session_state.inventory_results['damaged']
+      if isinstance(st.session_state.inventory_results, LotResultStore):
+        store = st.session_state.inventory_results
        
         st.markdown("---")
         st.markdown('<h2 class="section-header">📊 Analysis Results</h2>', unsafe_allow_html=True)
+
+        # Results of a running check stream in chunk by chunk
+        job = latest_check_job(session_jobs())
+        if job and job.active and not job.cancelled:
+          st.info(f"⏳ Showing partial results: {len(store.frame):,} of {job.total:,} lots classified so far. "
+                  "Damaged lots can already be reviewed and approved.")
        
         # Enhanced metrics display
-        display_enhanced_metrics(non_damaged, damaged, st.session_state.approved_lots,
-                   st.session_state.rejected_lots, st.session_state.processed_lots)
+        lot_status = st.session_state.lot_status
+        counts = inventory_counts(store, lot_status)
+        display_enhanced_metrics(counts)
        
         # Interactive visualizations
-        if non_damaged or damaged:
+        if counts['total']:
           st.markdown('<h3 class="section-header">📈 Visual Analytics</h3>', unsafe_allow_html=True)
          
-          fig_pie, fig_bar = create_visualization_charts(
-            non_damaged, damaged, st.session_state.approved_lots,
-            st.session_state.rejected_lots, st.session_state.processed_lots
-          )
+          fig_pie, fig_bar = create_visualization_charts(counts)
          
           col1, col2 = st.columns(2)
           with col1:
@@ -1810,264 +3353,37 @@ else:
             st.plotly_chart(fig_bar, use_container_width=True)
        
         # Display detailed results
-        if non_damaged:
+        if store.non_damaged_count:
           st.markdown('<h3 class="section-header">✅ Non-Damaged Items</h3>', unsafe_allow_html=True)
-          st.markdown(f"**{len(non_damaged)}** items are not in damage stock")
+          st.markdown(f"**{store.non_damaged_count}** items are not in damage stock")
          
           with st.expander("🔍 View Details", expanded=True):
-            non_damaged_data = []
-            for item in non_damaged:
-              details = item.get('details', {})
-              po_details = details.get('po_details', {}) if details else {}
-
-              non_damaged_data.append({
-                'Lot/Serial': item['lot'],
-                'Location': item['location'],
-                'Status': item['status'],
-                'Reference': details.get('reference', 'N/A') if details else 'N/A',
-                'Product': details.get('product_name', 'N/A') if details else 'N/A',
-                'SKU': details.get('sku', 'N/A') if details else 'N/A',
-                'Vendor': po_details.get('vendor', 'N/A') if po_details else 'N/A',
-                'Price': f"${po_details.get('price_unit', 0):.2f}",
-                'Discount': f"{po_details.get('discount', 0)}%" if po_details.get('discount', 0) else "0%",
-                'Cost Price': f"${po_details.get('cost_price', 0):.2f}",
-                'Available Qty': details.get('available_qty', 0) if details else 0,
-              })
-
-            non_damaged_df = pd.DataFrame(non_damaged_data)
-            st.dataframe(non_damaged_df, use_container_width=True, height=300)
+            non_damaged_df = cached_table('non_damaged', store.token, lambda: build_non_damaged_table(store))
+            st.dataframe(non_damaged_df, use_container_width=True, height=300, column_config=PRICE_COLUMN_CONFIG)
 
        
         # Enhanced damaged items section
-        if damaged:
+        if store.damaged_count:
           st.markdown('<h3 class="section-header">⚠️ Damaged Items Management</h3>', unsafe_allow_html=True)
          
-          # Create enhanced damaged items table
-          damaged_data = []
-          for item in damaged:
-            lot = item['lot']
-            po_number = st.session_state.lot_po_mapping.get(lot, "Not Found")
-            details = item.get('details', {})
-            po_details = details.get('po_details', {}) if details else {}
-
-            if lot in st.session_state.processed_lots:
-              status = '✅ Return Processed'
-            elif lot in st.session_state.approved_lots:
-              status = '📝 Approved for Return'
-            elif lot in st.session_state.rejected_lots:
-              status = '❌ Rejected for Return'
-            else:
-              status = '⏳ Pending Action'
-
-            damaged_data.append({
-              'Lot/Serial': lot,
-              'Location': item['location'],
-              'PO Number': po_number,
-              'Status': status,
-              'Reference': details.get('reference', 'N/A') if details else 'N/A',
-              'Product': details.get('product_name', 'N/A') if details else 'N/A',
-              'SKU': details.get('sku', 'N/A') if details else 'N/A',
-              'Vendor': po_details.get('vendor', 'N/A') if po_details else 'N/A',
-              'Price': f"${po_details.get('price_unit', 0):.2f}",
-              'Discount': f"{po_details.get('discount', 0)}%" if po_details.get('discount', 0) else "0%",
-              'Cost Price': f"${po_details.get('cost_price', 0):.2f}",
-              'Available Qty': details.get('available_qty', 0) if details else 0,
-            })
-
-          damaged_df = pd.DataFrame(damaged_data)
-          st.dataframe(damaged_df, use_container_width=True, height=400)
-         
-          # Bulk action management
-          st.markdown('<div class="action-panel">', unsafe_allow_html=True)
-          st.markdown('<div class="action-title">🎯 Bulk Actions</div>', unsafe_allow_html=True)
-         
-          # Get lots that are pending action
-          pending_lots = [item['lot'] for item in damaged if item['lot'] not in st.session_state.processed_lots and
-                 item['lot'] not in st.session_state.approved_lots and
-                 item['lot'] not in st.session_state.rejected_lots]
-         
-          if pending_lots:
-            st.markdown(f"**{len(pending_lots)}** items are awaiting your decision")
-           
-            # Selection controls
-            col1, col2 = st.columns([2, 1])
-
-            with col1:
-                
-                if "selected_damaged_lots" not in st.session_state:
-                    st.session_state.selected_damaged_lots = []
-
-                # Button-based Select All/Clear All
-                col1, col2, col3 = st.columns(3)
-
-                with col1:
-                    if st.button("Select All", use_container_width=True):
-                        st.session_state.selected_damaged_lots = pending_lots.copy()
-                        st.rerun()
-
-                with col2:
-                    if st.button("Clear All", use_container_width=True):
-                        st.session_state.selected_damaged_lots = []
-                        st.rerun()
-
-                with col3:
-                    st.markdown(f"**Selected:** {len(st.session_state.selected_damaged_lots)}")
-           
-            if st.session_state.selected_damaged_lots:
-              st.info(f"💡 {len(st.session_state.selected_damaged_lots)} item(s) selected for action")
-             
-              # Action buttons with enhanced styling
-              col1, col2, col3 = st.columns(3)
-             
-              with col1:
-                if st.button(
-                  f"✅ Approve Selected ({len(st.session_state.selected_damaged_lots)})",
-                  type="primary",
-                  use_container_width=True
-                ):
-                  for lot in st.session_state.selected_damaged_lots:
-                    if lot not in st.session_state.approved_lots:
-                      st.session_state.approved_lots.append(lot)
-                    if lot in st.session_state.rejected_lots:
-                      st.session_state.rejected_lots.remove(lot)
-                 
-                  st.success(f"✅ Approved {len(st.session_state.selected_damaged_lots)} items for return!")
-                  st.session_state.selected_damaged_lots = []
-                  time.sleep(1)
-                  st.rerun()
-             
-              with col2:
-                if st.button(
-                  f"❌ Reject Selected ({len(st.session_state.selected_damaged_lots)})",
-                  use_container_width=True
-                ):
-                  for lot in st.session_state.selected_damaged_lots:
-                    if lot not in st.session_state.rejected_lots:
-                      st.session_state.rejected_lots.append(lot)
-                    if lot in st.session_state.approved_lots:
-                      st.session_state.approved_lots.remove(lot)
-                 
-                  st.warning(f"❌ Rejected {len(st.session_state.selected_damaged_lots)} items!")
-                  st.session_state.selected_damaged_lots = []
-                  time.sleep(1)
-                  st.rerun()
-             
-              with col3:
-                if st.button("🔄 Clear Selection", use_container_width=True):
-                  st.session_state.selected_damaged_lots = []
-                  st.session_state.select_all_damaged = False
-                  st.rerun()
-          else:
-            st.success("🎉 All damaged items have been processed!")
-         
-          st.markdown('</div>', unsafe_allow_html=True)
+          # Create enhanced damaged items table (rebuilt only when results or review statuses change)
+          damaged_df = cached_table(
+            'damaged', (store.token, lot_status.version),
+            lambda: build_damaged_table(store, lot_status, st.session_state.lot_po_mapping)
+          )
+          st.dataframe(damaged_df, use_container_width=True, height=400, column_config=PRICE_COLUMN_CONFIG)
          
-          # Process approved returns section
-          if st.session_state.approved_lots:
-            st.markdown("---")
-            st.markdown('<h3 class="section-header">🔄 Return Processing Center</h3>', unsafe_allow_html=True)
-           
-            st.markdown(f"""
-            <div class="status-card info-card">
-              <h4>📋 Ready for Processing</h4>
-              <p><strong>{len(st.session_state.approved_lots)}</strong> lot(s) have been approved and are ready for return processing.</p>
-              <p><strong>Next Step:</strong> Click the button below to process all approved returns.</p>
-            </div>
-            """, unsafe_allow_html=True)
-           
-          # --- Show Approved Items Section ---
-          with st.expander("📋 View Approved Items", expanded=False):
-              approved_data = []
-              for lot in st.session_state.approved_lots:
-                po_number = st.session_state.lot_po_mapping.get(lot, "Not Found")
-                approved_data.append({
-                    'Lot/Serial': lot,
-                    'PO Number': po_number,
-                    'Available Qty': st.session_state.lot_details.get(lot, {}).get('available_qty', 0),
-                    'Status': 'Approved for Return'
-                })
-
-              approved_df = pd.DataFrame(approved_data)
-              st.dataframe(approved_df, use_container_width=True)
-          
-          
-          # --- Process Returns Section ---
-          col1, col2 = st.columns([2, 1])
-          
-          with col1:
-              button_label = f"🚀 Process Returns for All Approved Lots ({len(st.session_state.approved_lots)})"
-              process_button = st.button(button_label, type="primary", use_container_width=True)
-          
-              if process_button:
-                  if st.session_state.get("process_clicked", False):
-                      st.error("⚠️ Return processing already initiated. Please wait or refresh.")
-                  elif not st.session_state.approved_lots:
-                      st.warning("No approved lots found to process.")
-                  else:
-                      st.session_state.process_clicked = True  # ✅ Prevents double-clicks
-          
-                      with st.spinner("🔄 Processing returns... This may take a moment."):
-                          progress_bar = st.progress(0)
-                          status_text = st.empty()
-          
-                          # ✅ Call the actual processing function
-                          success, result = process_product_return(st.session_state.approved_lots)
-          
-                          if success:
-                              processed_count = 0
-                              for lot in st.session_state.approved_lots:
-                                  if lot in result['results'] and result['results'][lot]['success']:
-                                      st.session_state.processed_lots[lot] = {
-                                          'status': 'Return Processed',
-                                          'po_number': result['results'][lot].get('po_number', 'N/A'),
-                                          'new_picking_id': result['results'][lot].get('new_picking_id', 'N/A'),
-                                          'returned_reference': result['results'][lot].get('returned_reference', 'N/A'),
-                                          'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                                      }
-                                      processed_count += 1
-          
-                              # ✅ Clear approved lots after successful processing
-                              st.session_state.approved_lots = []
-          
-                              # ✅ Display summary results
-                              st.markdown(f"""
-                              <div class="status-card success-card">
-                                <h4>🎉 Processing Complete!</h4>
-                                <p><strong>✅ Successful:</strong> {result['success_count']} returns processed</p>
-                                <p><strong>❌ Failed:</strong> {result['failure_count']} returns failed</p>
-                              </div>
-                              """, unsafe_allow_html=True)
-          
-                              # ✅ Show failed results if any
-                              if result['failure_count'] > 0:
-                                  with st.expander("❌ View Failed Returns"):
-                                      for lot, res in result['results'].items():
-                                          if not res['success']:
-                                              st.error(f"**{lot}:** {res.get('message', 'No error message provided.')}")
-          
-                              progress_bar.empty()
-                              status_text.empty()
-                              time.sleep(2)
-                              st.rerun()
-          
-                          else:
-                              st.error(f"❌ Return processing failed: {result}")
-                              progress_bar.empty()
-                              status_text.empty()
-                              st.session_state.process_clicked = False  # allow retry if failure
-          
-          
-          with col2:
-              if st.button("📋 View Details", use_container_width=True):
-                  st.info("Details view coming soon.")
+          # Bulk actions and the return center are fragments: their clicks rerun only their section
+          render_bulk_actions(lot_status)
+          render_return_center(store, lot_status)
 
-          
        
         # Summary section with processed items
         if st.session_state.processed_lots:
           st.markdown('<h3 class="section-header">✅ Processed Returns Summary</h3>', unsafe_allow_html=True)
          
           processed_data = []
+          available_qty = lot_records(list(st.session_state.processed_lots))['available_qty']
           for lot, details in st.session_state.processed_lots.items():
             processed_data.append({
               'Lot/Serial': lot,
@@ -2076,7 +3392,7 @@ else:
               'Picking ID': details.get('new_picking_id', 'N/A') if details else 'N/A',
               'Status': '✅ Completed',
               'Processed Time': details.get('timestamp', 'N/A'),
-              'Available Qty': st.session_state.lot_details.get(lot, {}).get('available_qty', 0)
+              'Available Qty': available_qty[lot]
             })
          
           processed_df = pd.DataFrame(processed_data)
@@ -2094,33 +3410,7 @@ else:
         col1, col2 = st.columns([2, 1])
        
         with col1:
-          # Create Excel report
-          excel_data = create_excel_report(
-            non_damaged,
-            damaged,
-            st.session_state.approved_lots,
-            st.session_state.rejected_lots,
-            st.session_state.processed_lots
-          )
-          # Right before the download section, add:
-          # st.write(f"Debug - Total approved lots: {len(st.session_state.approved_lots)}")
-          # st.write(f"Debug - Approved lots list: {st.session_state.approved_lots}")
-          # st.write(f"Debug - Total processed lots: {len(st.session_state.processed_lots)}")
-          # st.write(f"Debug - Total rejected lots: {len(st.session_state.rejected_lots)}")
-         
-          # Enhanced download button
-          st.download_button(
-            label="⬇️ Download Excel Report",
-            data=create_excel_report(
-              non_damaged, damaged,
-              st.session_state.approved_lots,
-              st.session_state.rejected_lots,
-              st.session_state.processed_lots
-            ),
-            file_name=f"inventory_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True
-          )
+          render_report_download(store, lot_status)
        
         with col2:
           st.markdown(f"""
@@ -2146,27 +3436,34 @@ else:
        
         with col1:
           if st.button("🔄 New Analysis", use_container_width=True):
-            # Clear current results
+            # Clear current results (rows of reviewed lots stay available to the reports)
+            cancel_check_jobs()
+            archive_reviewed_results()
             st.session_state.inventory_results = None
             st.session_state.damaged_lots = []
             st.session_state.selected_damaged_lots = []
             st.session_state.lot_po_mapping = {}
+            st.session_state.lot_resolution = {}
+            lot_status.sync_pending([])
             st.rerun()
        
         with col2:
           if st.button("🧹 Reset All Data", use_container_width=True):
             # Clear all session data except authentication
-            keys_to_clear = ['inventory_results', 'damaged_lots', 'approved_lots',
-                  'rejected_lots', 'processed_lots', 'selected_damaged_lots',
-                  'lot_po_mapping']
+            cancel_check_jobs()
+            keys_to_clear = ['inventory_results', 'damaged_lots', 'processed_lots', 'selected_damaged_lots',
+                  'lot_po_mapping', 'lot_resolution', 'return_results']
             for key in keys_to_clear:
               if key in st.session_state:
-                if key == 'processed_lots':
+                if key in ('processed_lots', 'lot_resolution'):
                   st.session_state[key] = {} # Reset to empty dictionary
                 elif 'lots' in key:
                   st.session_state[key] = [] # Reset to empty list
                 else:
                   st.session_state[key] = None
+            st.session_state.lot_status = LotStatusIndex()
+            st.session_state.lot_history = LotResultStore()
+            st.session_state.table_cache = {}
             st.success("🧹 All data cleared successfully!")
             time.sleep(1)
             st.rerun()
@@ -0,0 +1,93 @@
+"""Compare XML-RPC and JSON-RPC serialization/parse time on captured Odoo payloads.
+
+Capture payloads from the configured Odoo (reads .env like app.py):
+  python benchmark_transport.py capture payloads/ --limit 5000
+
+Benchmark the captured payloads:
+  python benchmark_transport.py run payloads/ --repeat 5
+"""
+import argparse
+import json
+import os
+import time
+import xmlrpc.client
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Representative search_read calls made by check_inventory_stream and process_product_return
+CAPTURE_QUERIES = {
+  'stock_quant': ('stock.quant', ['lot_id', 'location_id', 'quantity']),
+  'stock_move_line': ('stock.move.line', ['id', 'lot_id', 'picking_id', 'product_id']),
+  'purchase_order_line': ('purchase.order.line', ['order_id', 'product_id', 'price_unit', 'discount']),
+}
+
+def capture(directory, limit):
+  """Pull representative search_read payloads from Odoo and save them as JSON"""
+  load_dotenv()
+  url, db = os.getenv('ODOO_URL'), os.getenv('ODOO_DB')
+  username, password = os.getenv('ODOO_USERNAME'), os.getenv('ODOO_PASSWORD')
+
+  common = xmlrpc.client.ServerProxy(f"{url}/xmlrpc/2/common")
+  uid = common.authenticate(db, username, password, {})
+  models = xmlrpc.client.ServerProxy(f"{url}/xmlrpc/2/object")
+
+  directory.mkdir(parents=True, exist_ok=True)
+  for name, (model, fields) in CAPTURE_QUERIES.items():
+    records = models.execute_kw(db, uid, password, model, 'search_read', [[]], {'fields': fields, 'limit': limit})
+    (directory / f"{name}.json").write_text(json.dumps(records))
+    print(f"Captured {len(records):,} {model} records → {directory / f'{name}.json'}")
+
+def best_of(repeat, fn):
+  """Best wall time in milliseconds over `repeat` runs"""
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    timings.append((time.perf_counter() - start) * 1000)
+  return min(timings)
+
+def run(directory, repeat):
+  """Time encode/decode of every captured payload with both wire formats"""
+  payload_files = sorted(directory.glob('*.json'))
+  if not payload_files:
+    raise SystemExit(f"No captured payloads found in {directory}")
+
+  print(f"{'payload':<24}{'records':>9}{'xml KB':>10}{'json KB':>10}"
+        f"{'xml ser ms':>12}{'json ser ms':>13}{'xml parse ms':>14}{'json parse ms':>15}")
+
+  for path in payload_files:
+    records = json.loads(path.read_text())
+
+    # Wrap the records the way each server sends a method response
+    xml_body = xmlrpc.client.dumps((records,), methodresponse=True, allow_none=True)
+    json_body = json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': records})
+
+    xml_ser = best_of(repeat, lambda: xmlrpc.client.dumps((records,), methodresponse=True, allow_none=True))
+    json_ser = best_of(repeat, lambda: json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': records}))
+    xml_parse = best_of(repeat, lambda: xmlrpc.client.loads(xml_body, use_builtin_types=True))
+    json_parse = best_of(repeat, lambda: json.loads(json_body))
+
+    print(f"{path.stem:<24}{len(records):>9,}{len(xml_body) / 1024:>10.1f}{len(json_body) / 1024:>10.1f}"
+          f"{xml_ser:>12.2f}{json_ser:>13.2f}{xml_parse:>14.2f}{json_parse:>15.2f}")
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  capture_parser = subparsers.add_parser('capture', help='Capture payloads from Odoo')
+  capture_parser.add_argument('directory', type=Path)
+  capture_parser.add_argument('--limit', type=int, default=5000)
+
+  run_parser = subparsers.add_parser('run', help='Benchmark captured payloads')
+  run_parser.add_argument('directory', type=Path)
+  run_parser.add_argument('--repeat', type=int, default=5)
+
+  args = parser.parse_args()
+  if args.command == 'capture':
+    capture(args.directory, args.limit)
+  else:
+    run(args.directory, args.repeat)
+
+if __name__ == '__main__':
+  main()